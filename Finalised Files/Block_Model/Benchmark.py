@@ -0,0 +1,273 @@
+"""
+Benchmarks for Block_Reliability.
+
+Runs the construction of the model, sample_total_throughput and sample_reliability on the example models, and on generated models
+of 200, 500 and 1000 machines, and records the startup time, the number of failures lists evaluated per second, and the peak memory
+of each. The results can be saved as a json baseline, and later runs compared against it, any metric that is worse than the
+baseline by more than the tolerance is flagged as a regression.
+
+usage:
+    python Benchmark.py                          run, and compare against benchmark_baseline.json if it exists
+    python Benchmark.py --update                 run, and save the results as the new baseline
+    python Benchmark.py --models example_model.csv synthetic_200 --masks 50
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from Block_Reliability import handle_csv
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+EXAMPLE_MODELS = ["example_model.csv", "example_model2.csv", "example_model3.csv"]
+SYNTHETIC_SIZES = [200, 500, 1000]
+
+#the metrics that are better when they are higher, the rest are better when they are lower
+HIGHER_IS_BETTER = ("total_throughput_per_second", "reliability_per_second")
+
+
+def generate_model(filename, machines, block_size = (2, 6), skip_every = 8, skip_length = 3, stockpile_every = 10,
+                   capacities = (500, 1000, 2000, 5000, 10500), seed = 0):
+    """
+    Writes a csv file of a made up model in the same format as the example models.
+
+    Parameters
+    ----------
+    filename : string
+        the path of the csv file to create
+    machines : int
+        the number of machines in the model
+    block_size : tuple(int), optional
+        the smallest and largest number of machines in a block. The default is (2, 6).
+    skip_every : int, optional
+        a skip starts every skip_every blocks, 0 for no skips. The default is 8.
+    skip_length : int, optional
+        the number of blocks each skip goes over. The default is 3.
+    stockpile_every : int, optional
+        every stockpile_every-th block is a stockpile, 0 for no stockpiles. The default is 10.
+    capacities : tuple(float), optional
+        the capacities the machines can have, the machines in a block all have the same capacity. The default is (500, 1000, 2000, 5000, 10500).
+    seed : int, optional
+        the seed of the random numbers. The default is 0.
+
+    Returns
+    -------
+    None.
+
+    """
+    rng = random.Random(seed)
+    rows = []
+    block = 0
+    skip_end = None #the block number the current skip ends at
+
+    while len(rows) < machines:
+        size = min(rng.randint(*block_size), machines - len(rows))
+
+        skips_to = ""
+        if skip_every and skip_end is None and block > 0 and block % skip_every == 0:
+            name = "Skip_" + str(block)
+            skip_end = block + 1 + skip_length
+            skips_to = "Block_" + str(skip_end)
+        elif stockpile_every and block % stockpile_every == stockpile_every - 1:
+            name = "Stockpile_" + str(block)
+        else:
+            name = "Block_" + str(block)
+        if skip_end == block:
+            skip_end = None
+            name = "Block_" + str(block)
+
+        capacity = rng.choice(capacities)
+        for machine in range(size):
+            rows.append([name + "_" + str(machine), "", 0.05, round(rng.uniform(0.85, 0.98), 3), 0.75, 0.85, capacity, name,
+                         skips_to if machine == 0 else ""])
+        block += 1
+
+    #a skip that has not ended by the last block ends there
+    if skip_end is not None:
+        for row in rows:
+            if row[8] == "Block_" + str(skip_end):
+                row[8] = rows[-1][7]
+
+    with open(filename, mode = 'w', newline = '') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Component", "Runtime", "Planned", "Availability", "Uterlisation ", "Loading ", "Capacity", "BlockID", "Skips_To"])
+        writer.writerows(rows)
+
+
+def benchmark_model(filename, masks = 100, offline = 0.05, seed = 0, repeats = 5):
+    """
+    Benchmarks one model. The times are the best of repeats runs, and the memory is measured in a separate run, as tracemalloc
+    slows everything down. The csv file is copied into a temporary folder first, so the cache written next to it for the cached
+    startup does not touch any cache next to the original.
+
+    Parameters
+    ----------
+    filename : string
+        the path of the csv file of the model
+    masks : int, optional
+        the number of random failures lists to evaluate. The default is 100.
+    offline : float, optional
+        the chance of each machine being offline in the failures lists. The default is 0.05.
+    seed : int, optional
+        the seed of the random failures lists. The default is 0.
+    repeats : int, optional
+        the number of times each thing is timed. The default is 5.
+
+    Returns
+    -------
+    map
+        machines : the number of machines
+        startup_seconds : the time to build the model from the csv file
+        cached_startup_seconds : the time to load the model from its cache
+        total_throughput_per_second : failures lists per second through sample_total_throughput
+        reliability_per_second : failures lists per second through sample_reliability, starting from an empty cache
+        peak_memory_bytes : the most memory used (as seen by tracemalloc) while building the model and evaluating the failures lists
+
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        copy = os.path.join(folder, os.path.basename(filename))
+        shutil.copyfile(filename, copy)
+        return benchmark_copy(copy, masks, offline, seed, repeats)
+
+
+def benchmark_copy(filename, masks, offline, seed, repeats):
+    """
+    Benchmarks one model from a csv file with nothing else next to it, see benchmark_model.
+    """
+    def timed(function):
+        best = None
+        for repeat in range(repeats):
+            start = time.perf_counter()
+            function()
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        return best
+
+    startup = timed(lambda: handle_csv(filename, cache = False))
+
+    system = handle_csv(filename, cache = False).system
+    rng = random.Random(seed)
+    machine_count = len(system.machine_values[0])
+    failures = [tuple(0 if rng.random() < offline else 1 for machine in range(machine_count)) for mask in range(masks)]
+
+    def total_throughput():
+        for mask in failures:
+            system.sample_total_throughput(mask)
+
+    def reliability():
+        fresh = handle_csv(filename, cache = False).system
+        start = time.perf_counter()
+        for mask in failures:
+            fresh.sample_reliability(mask)
+        return time.perf_counter() - start
+
+    total_throughput_seconds = timed(total_throughput)
+    reliability_seconds = min(reliability() for repeat in range(repeats))
+
+    tracemalloc.start()
+    system = handle_csv(filename, cache = False).system
+    for mask in failures:
+        system.sample_total_throughput(mask)
+        system.sample_reliability(mask)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    #the cache is written by the first load, and read by the rest
+    handle_csv(filename, cache = True)
+    cached_startup = timed(lambda: handle_csv(filename, cache = True))
+
+    return {"machines" : machine_count,
+            "startup_seconds" : startup,
+            "cached_startup_seconds" : cached_startup,
+            "total_throughput_per_second" : masks/total_throughput_seconds,
+            "reliability_per_second" : masks/reliability_seconds,
+            "peak_memory_bytes" : peak}
+
+
+def compare(results, baseline, tolerance = 0.2):
+    """
+    Returns the list of regressions, (model, metric, baseline value, new value), the metrics that are worse than in the baseline
+    by more than tolerance (as a fraction of the baseline value).
+    """
+    regressions = []
+    for model in results:
+        if not model in baseline:
+            continue
+        for metric, value in results[model].items():
+            old = baseline[model].get(metric)
+            if old is None or metric == "machines":
+                continue
+            if metric in HIGHER_IS_BETTER:
+                worse = value < old*(1 - tolerance)
+            else:
+                worse = value > old*(1 + tolerance)
+            if worse:
+                regressions.append((model, metric, old, value))
+    return regressions
+
+
+def run(models = None, masks = 100, folder = None, seed = 0):
+    """
+    Runs the benchmark on each model, the names of the example csv files, or "synthetic_" followed by a number of machines, which
+    are generated in folder. Returns the map of model to its results, see benchmark_model.
+    """
+    if models is None:
+        models = EXAMPLE_MODELS + ["synthetic_" + str(size) for size in SYNTHETIC_SIZES]
+    if folder is None:
+        folder = os.path.join(HERE, "benchmark_models")
+
+    results = {}
+    for model in models:
+        if model.startswith("synthetic_"):
+            os.makedirs(folder, exist_ok = True)
+            filename = os.path.join(folder, model + ".csv")
+            generate_model(filename, int(model[len("synthetic_"):]), seed = seed)
+        else:
+            filename = os.path.join(HERE, model)
+        results[model] = benchmark_model(filename, masks, seed = seed)
+        print(model, json.dumps(results[model]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmarks for Block_Reliability")
+    parser.add_argument("--models", nargs = "*", default = None, help = "example csv files, or synthetic_(machines)")
+    parser.add_argument("--masks", type = int, default = 100, help = "failures lists evaluated per model")
+    parser.add_argument("--baseline", default = os.path.join(HERE, "benchmark_baseline.json"))
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "how much worse than the baseline is a regression")
+    parser.add_argument("--update", action = "store_true", help = "save the results as the new baseline")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    results = run(args.models, args.masks, seed = args.seed)
+
+    if args.update:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        baseline.update(results)
+        with open(args.baseline, mode = 'w') as file:
+            json.dump(baseline, file, indent = 4)
+        print("saved the baseline to", args.baseline)
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print("no baseline at", args.baseline, "run with --update to create one")
+        sys.exit(0)
+
+    with open(args.baseline) as file:
+        regressions = compare(results, json.load(file), args.tolerance)
+    for model, metric, old, new in regressions:
+        print("REGRESSION", model, metric, "baseline", old, "now", new)
+    if not regressions:
+        print("no regressions")
+    sys.exit(1 if regressions else 0)
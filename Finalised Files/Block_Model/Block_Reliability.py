@@ -1,7 +1,19 @@
 import csv
+import hashlib
+import heapq
+import io
+import json
 import numpy as np
 import itertools
 import math
+import multiprocessing
+import operator
+import os
+import shutil
+import statistics
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
 
 def srt(x):
     x.sort()
@@ -14,25 +26,331 @@ def int2bin(n, length):
         m = n
     return [0,]*(length-math.ceil(math.log(m+1)/math.log(2)))+[int(x) for x in str(bin(n))[2:]]
 
+TABLE_MAGIC = b"BRTABLE1"
+
+INDEX_MAGIC = b"BRINDEX1"
+
+CACHE_MAGIC = b"BRCACHE1"
+CACHE_VERSION = 3
+
+#the opcodes of the steps in System.plan, see System.compile_plan
+SERIES = 0
+STOCKPILE = 1
+OPEN = 2
+NEXT_BRANCH = 3
+CLOSE = 4
+
+#the state System.plan is run from, (Path, Stockpiled, Frames), see System.apply_step
+EMPTY_STATE = (None, False, ())
+
+def open_table(filename, file_format):
+    """
+    Opens a throughput table for writing, as text for csv, and binary otherwise
+    """
+    if file_format == "csv":
+        return open(filename, mode = 'w', newline = '')
+    return open(filename, mode = 'wb')
+
+#each worker process of generate_throughput_table_parallel loads its own copy of the model, as the System cannot be pickled
+_shard_worker_table = None
+
+def _init_shard_worker(filename, resolution = None, threshold = None):
+    global _shard_worker_table
+    _shard_worker_table = handle_csv(filename, resolution = resolution, threshold = threshold)
+
+def _generate_shard(args):
+    """
+    Writes one shard of generate_throughput_table_parallel, to a temporary file that is renamed once it is complete.
+    """
+    depth, classes, start, stop, path, file_format, chunk_size = args
+    options = _shard_worker_table.configuration_options(depth, classes)
+    temporary = path + "." + str(os.getpid()) + ".tmp"
+    with open_table(temporary, file_format) as file:
+        _shard_worker_table.write_throughput_range(file, options, start, stop, file_format, chunk_size)
+    os.replace(temporary, path)
+    return path
+
+def offline_key(offline, words):
+    """
+    Packs a list of offline machine indices into a bitmask, bit i (bit i%64 of word i//64) is set if machine i is offline.
+
+    Parameters
+    ----------
+    offline : list(int)
+        the indices of the machines that are offline, in machine_values order
+    words : int
+        the number of uint64 words in the key, ceil(machine count/64)
+
+    Returns
+    -------
+    array(uint64)
+        the key
+
+    """
+    key = sum(1 << i for i in set(offline))
+    return np.array([(key >> (64*word)) & 0xFFFFFFFFFFFFFFFF for word in range(words)], dtype = np.uint64)
+
+def read_throughput_table(filename):
+    """
+    Reads a binary throughput table written by handle_csv.generate_throughput_table, one chunk at a time.
+    
+    The file is a header of the 8 bytes "BRTABLE1" followed by the machine count and the key word count (uint64),
+    then the chunks, each chunk is 
+        the row count, and entry count (uint64)
+        the keys (row count x word count uint64), see offline_key
+        the number of throughputs in each rows distribution (row count uint64)
+        the throughputs of all the rows distributions (entry count float64)
+        the probabilities of all the rows distributions (entry count float64)
+    all little endian.
+
+    Parameters
+    ----------
+    filename : string
+        the path to the table
+
+    Yields
+    ------
+    keys, lengths, support, probs
+        the arrays of one chunk, the distribution of row i is support[sum(lengths[:i]):sum(lengths[:i+1])] with the matching probs
+
+    """
+    with open(filename, mode = 'rb') as file:
+        if file.read(len(TABLE_MAGIC)) != TABLE_MAGIC:
+            raise ValueError(filename + " is not a throughput table")
+        machine_count, words = np.fromfile(file, dtype = "<u8", count = 2)
+        while True:
+            counts = np.fromfile(file, dtype = "<u8", count = 2)
+            if len(counts) < 2:
+                return
+            rows, entries = int(counts[0]), int(counts[1])
+            keys = np.fromfile(file, dtype = "<u8", count = rows*int(words)).reshape(rows, int(words))
+            lengths = np.fromfile(file, dtype = "<u8", count = rows)
+            support = np.fromfile(file, dtype = "<f8", count = entries)
+            probs = np.fromfile(file, dtype = "<f8", count = entries)
+            yield keys, lengths, support, probs
+
+def throughput_table_chunks(filename, chunk_size = 10000):
+    """
+    Reads a throughput table in either format, one chunk at a time, the same way as read_throughput_table. For a csv table the keys
+    are made from the Mask column, and the chunks are chunk_size rows long.
+    """
+    with open(filename, mode = 'rb') as file:
+        binary = file.read(len(TABLE_MAGIC)) == TABLE_MAGIC
+    if binary:
+        yield from read_throughput_table(filename)
+        return
+    
+    def chunk(rows):
+        words = (len(rows[0][1])+63)//64
+        keys = np.array([offline_key([i for i, c in enumerate(row[1]) if c == "0"], words) for row in rows], dtype = "<u8").reshape(len(rows), words)
+        support = [np.array(row[3].split(";"), dtype = float) if row[3] else np.zeros(0) for row in rows]
+        probs = [np.array(row[4].split(";"), dtype = float) if row[4] else np.zeros(0) for row in rows]
+        return keys, np.array([len(x) for x in support], dtype = "<u8"), np.concatenate(support), np.concatenate(probs)
+    
+    with open(filename, mode = 'r', newline = '') as file:
+        reader = csv.reader(file)
+        next(reader)
+        rows = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) == chunk_size:
+                yield chunk(rows)
+                rows = []
+        if rows:
+            yield chunk(rows)
+
+def index_throughput_table(table_filename, filename = None):
+    """
+    Builds an index of a throughput table (either format), so the distribution of any configuration in it can be looked up with
+    a binary search of a memory mapped file, see ThroughputIndex.
+    
+    The file is the 8 bytes "BRINDEX1", then the machine count, key word count, row count and payload length (uint64), then 
+    starting on multiples of 64 bytes
+        the keys of the rows, sorted (row count x word count uint64), see offline_key, with the first word the most significant
+        the offset of each rows distribution in the payload (row count uint64)
+        the number of throughputs in each rows distribution (row count uint64)
+        the payload (float64), the distribution of each row is its throughputs followed by their probabilities
+    all little endian. The table is read twice, once for the keys, and once to copy the distributions, so it never has to fit
+    in memory, only the keys do.
+
+    Parameters
+    ----------
+    table_filename : string
+        the path of the table, see handle_csv.generate_throughput_table
+    filename : string, optional
+        the path of the index to create. The default is the table file name with .index added on the end, so tables that only 
+        differ in their extension (t.csv and t.bin) get different indexes.
+
+    Returns
+    -------
+    string
+        the path of the index
+
+    """
+    if filename is None:
+        filename = table_filename + ".index"
+    align = lambda n: -(-n//64)*64
+    
+    keys = []
+    lengths = []
+    for chunk in throughput_table_chunks(table_filename):
+        keys.append(chunk[0])
+        lengths.append(chunk[1])
+    if not keys:
+        raise ValueError(table_filename + " has no rows")
+    keys = np.concatenate(keys)
+    lengths = np.concatenate(lengths)
+    offsets = np.concatenate(([0], np.cumsum(2*lengths)[:-1])).astype("<u8")
+    order = np.lexsort(keys.T[::-1])
+    
+    with open(table_filename, mode = 'rb') as file:
+        binary = file.read(len(TABLE_MAGIC)) == TABLE_MAGIC
+        if binary:
+            machine_count = int(np.fromfile(file, dtype = "<u8", count = 1)[0])
+    if not binary: #the mask of a csv table has a character for each machine
+        with open(table_filename, mode = 'r', newline = '') as file:
+            reader = csv.reader(file)
+            next(reader)
+            machine_count = len(next(reader)[1])
+    
+    header = np.array([machine_count, keys.shape[1], len(keys), 2*int(lengths.sum())], dtype = "<u8")
+    temporary = filename + "." + str(os.getpid()) + ".tmp"
+    with open(temporary, mode = 'wb') as file:
+        file.write(INDEX_MAGIC)
+        file.write(header.tobytes())
+        for array in (keys[order], offsets[order], lengths[order]):
+            file.write(bytes(align(file.tell()) - file.tell()))
+            file.write(np.ascontiguousarray(array, dtype = "<u8").tobytes())
+        file.write(bytes(align(file.tell()) - file.tell()))
+        for chunk_keys, chunk_lengths, support, probs in throughput_table_chunks(table_filename):
+            position = 0
+            for length in chunk_lengths.tolist():
+                file.write(support[position:position+length].astype("<f8").tobytes())
+                file.write(probs[position:position+length].astype("<f8").tobytes())
+                position += length
+    os.replace(temporary, filename)
+    return filename
+
+
+class ThroughputIndex:
+    def __init__(self, filename):
+        """
+        This class looks up distributions in an index made by index_throughput_table. The file is memory mapped, so nothing is read
+        until it is looked up, and a lookup is one binary search of the sorted keys.
+
+        Parameters
+        ----------
+        filename : string
+            the path of the index
+
+        Returns
+        -------
+        None.
+
+        """
+        align = lambda n: -(-n//64)*64
+        with open(filename, mode = 'rb') as file:
+            if file.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError(filename + " is not a throughput table index")
+            self.machine_count, self.words, self.rows, entries = [int(x) for x in np.fromfile(file, dtype = "<u8", count = 4)]
+        
+        position = align(len(INDEX_MAGIC) + 32)
+        arrays = []
+        for dtype, shape in (("<u8", (self.rows, self.words)), ("<u8", (self.rows,)), ("<u8", (self.rows,)), ("<f8", (entries,))):
+            if math.prod(shape) == 0:
+                arrays.append(np.zeros(shape, dtype = dtype))
+            else:
+                arrays.append(np.memmap(filename, dtype = dtype, mode = 'r', offset = position, shape = shape))
+            position = align(position + math.prod(shape)*8)
+        self.keys, self.offsets, self.lengths, self.payload = arrays
+        self.filename = filename
+    
+    def __len__(self):
+        return self.rows
+    
+    def find(self, key):
+        """
+        Returns the row of the key (see offline_key) in the index, or None if it is not in it
+        """
+        key = [int(word) for word in key]
+        if len(key) != self.words:
+            return None
+        if self.words == 1:
+            row = int(self.keys[:, 0].searchsorted(np.uint64(key[0])))
+        else:
+            row, high = 0, self.rows
+            while row < high:
+                middle = (row + high)//2
+                if self.keys[middle].tolist() < key:
+                    row = middle + 1
+                else:
+                    high = middle
+        if row < self.rows and self.keys[row].tolist() == key:
+            return row
+        return None
+    
+    def __contains__(self, key):
+        return self.find(key) is not None
+    
+    def get(self, key, default = None):
+        """
+        Returns the distribution of the key (see offline_key), as a DiscreteDistribution, or default if it is not in the index
+        """
+        row = self.find(key)
+        if row is None:
+            return default
+        offset, length = int(self.offsets[row]), int(self.lengths[row])
+        return DiscreteDistribution(self.payload[offset:offset+length], self.payload[offset+length:offset+2*length])
+    
+    def __getitem__(self, key):
+        dist = self.get(key)
+        if dist is None:
+            raise KeyError(key)
+        return dist
+
 class handle_csv:
     """
     Handle csv is the class used to handle the input and output of the csv files that represent the block systems
     
     """
-    def __init__(self, filename = 'example_model.csv'):
+    def __init__(self, filename = 'example_model.csv', cache = False, resolution = None, threshold = None):
         """
         
+        If cache is True, the compiled model is saved next to the csv file, as (filename).cache, the first time it is loaded 
+        (see System.save), and the next time the same csv file is loaded the model is loaded from there instead (see System.load).
+        The cache is matched to the csv file by the sha256 hash of its contents, so if the csv file changes it is rebuilt.
+        No block distributions are built up front, save_cache can be called again later to save the ones built since.
 
         Parameters
         ----------
         filename : string, optional
             the file name or path to the csv file you wish to load. The default is 'example_model.csv'.
+        cache : boolean, optional
+            whether to load and save the compiled model cache. The default is False.
+        resolution : float, optional
+            the resolution of the capacity grid, see System. The default is None, for exact distributions.
+        threshold : float, optional
+            the probability below which throughputs are dropped, see System. The default is None, for no truncation.
 
         Returns
         -------
         None.
 
         """
+        self.filename = filename
+        with open(filename, mode = 'rb') as file:
+            self.key = hashlib.sha256(file.read()).hexdigest()
+        if resolution is not None or threshold is not None: #an approximate model is cached separately from the exact one
+            self.key += ":" + repr(resolution) + ":" + repr(threshold)
+        self.cache_filename = filename + ".cache"
+        self.indexes = {} #the throughput table indexes opened by query, by path
+        
+        if cache:
+            loaded = System.load(self.cache_filename, self.key)
+            if loaded is not None:
+                self.system, self.components = loaded
+                return
+        
         self.components = {}
         with open(filename, mode = 'r') as file:
             File = csv.reader(file)
@@ -47,8 +365,8 @@ class handle_csv:
         
         block_list = {}
         
-        Skip_start = None
-        Skip_end = None
+        Skips = [] #the skips that have started but not ended, as [start block, end block], the innermost last
+        Previous = None #the block of the last component
         
         for component in self.components: #iterate through, and identify input, output, skips, and order of the components
             component = self.components[component]
@@ -56,16 +374,29 @@ class handle_csv:
             #checks if it is a skip
             label = "Block"
             if component["Skips_To"] != '':
-                Skip_start = component["BlockID"]
-                Skip_end = component["Skips_To"]
+                #a skip straight after another skip to the same place is the next block on the same skip path
+                if Skips and Skips[-1] == [Previous, component["Skips_To"]]:
+                    Skips[-1][0] = component["BlockID"]
+                else:
+                    Skips.append([component["BlockID"], component["Skips_To"]])
                 label = "Skip Start"
                 
-            if component["BlockID"] == Skip_start:
+            if component["BlockID"] in [Skip[0] for Skip in Skips]:
                 label = "Skip Start"
-                
-            if not Skip_end is None: 
-                if component["BlockID"] == Skip_end:
-                    block_list[("Skip End", Skip_start)] = []
+            
+            #ends the skips that end here, the skips inside them must end here too, or the skips cross, which is not a 
+            #series-parallel network
+            Ends = [Skip[1] for Skip in Skips]
+            if component["BlockID"] in Ends:
+                for Skip in Skips[Ends.index(component["BlockID"])+1:]:
+                    if Skip[1] != component["BlockID"]:
+                        raise ValueError("the skip " + Skip[0] + " to " + Skip[1] + " is inside the skip " + Skips[Ends.index(component["BlockID"])][0] + 
+                                         " that ends at " + component["BlockID"] + " before it, skips can not cross")
+                for Skip in reversed(Skips[Ends.index(component["BlockID"]):]):
+                    block_list[("Skip End", Skip[0])] = []
+                del Skips[Ends.index(component["BlockID"]):]
+            
+            Previous = component["BlockID"]
             
             #figure out of there is POF, or capacity, if not remove entry
             POF = float("0"+component["Availability"])
@@ -79,375 +410,2325 @@ class handle_csv:
                 
             block_list[(label, component["BlockID"])].append((component["Component"], Cap, 1-POF))
         
-        self.system = System(block_list)
+        for Skip in reversed(Skips): #the skips that have not ended by the last block end there
+            block_list[("Skip End", Skip[0])] = []
+        
+        self.system = System(block_list, resolution = resolution, threshold = threshold)
+        
+        if cache:
+            self.save_cache()
         
-    def generate_throughput_table(self, depth, warning = False):
+    def save_cache(self):
         """
+        Saves the compiled model, with every block distribution that is currently cached, to (filename).cache, see System.save.
+        If the file can not be written (a read only folder for example) the model is just not cached.
+        """
+        try:
+            self.system.save(self.cache_filename, self.key, self.components)
+        except OSError:
+            pass
+        
+    def configuration_options(self, depth, classes = False):
+        """
+        Lists the maintenance options of each block, that is each set of machines that can be offline together in that block, 
+        with at most depth machines offline.
+        
+        If classes is True, options that only differ in which of a set of identical machines (the same capacity and POF, see 
+        BlockDistribution) are offline are left out, as they have the same throughput distribution. Only the option with the 
+        first machines of each class offline is kept, so a block of 10 identical machines has 11 options rather than 2^10.
+
         Parameters
         ----------
         depth : int
-            for each layer, how many can be offline at any given time
-        warning : boolean, OPTIONAL
-            depending on the depth, and number of nodes, the operation may take a very long time,
-            and/or create a very large file select true to get a warning of the time it will take.
-            The default is False.
+            for each block, how many can be offline at any given time
+        classes : boolean, optional
+            whether to only keep one option for each number of machines offline in each class of identical machines. The default is False.
 
         Returns
-        None.
+        -------
+        list(list(tuple(int)))
+            for each block, the list of options, each option is a tuple of the indices (in machine_values order) of the offline machines.
 
         """
-        
-
-class System:
-    def __init__(self, block_list):
+        options = []
+        index = 0
+        for block in self.system.block_list:
+            machines = range(index, index+len(self.system.block_list[block]))
+            if classes and block[0] != "Skip End":
+                table = self.system.block_reliability_dist[block[1]]
+                counts = [counts for counts in itertools.product(*[range(min(depth, len(machine_class[2]))+1) for machine_class in table.classes]) 
+                          if sum(counts) <= depth]
+                block_options = [tuple(srt([index+position for machine_class, count in zip(table.classes, offline) for position in machine_class[2][:count]]))
+                                 for offline in counts]
+                options.append(sorted(block_options, key = lambda option: (len(option), option)))
+            else:
+                options.append([combination for count in range(min(depth, len(machines))+1) for combination in itertools.combinations(machines, count)])
+            index += len(machines)
+        return options
+    
+    def configuration_failures(self, offline):
         """
-        Parameters
-        ----------
-        block_list : {map(list)}
-            contains entries containing ("Block", "Block identifyer"): [(MachineID, Capacity, POF), ...]
-            or
-            tuples containing ("Skip Start", "Skip id") :[(MachineID, Capacity, POF), ...]
-            with a corresponding ("Skip End", "Skip id") : [] when it ends
-            The entries must be ordered as they are connected.
+        Turns a list of offline machine indices into the failures list used by System.sample_reliability
         """
-        
-        self.block_list = block_list
-        
-        #this array contains the two important parameters for each machine, indexed at the index of the machine
-        self.machine_values = np.array([list(itertools.chain.from_iterable([[machine[1] for machine in self.block_list[block]] for block in self.block_list])), #Capacity
-                                        list(itertools.chain.from_iterable([[machine[2] for machine in self.block_list[block]] for block in self.block_list]))])#POF
-        
-        # This section of code sets up the windows used in the sample_total_throughput function
-        
-        # The way these work is like so, if we take the example_model, and line up all its machines you get this:
-        
-        #OHP1, Ship_loader_1, Stacker_1, Stacker_2, Stacker_3, Stockpile_1, Relcaimer_1, Reclaimer_2, Reclaimer_3, Sink_1
-        
-        #We want to start by summing up the capacities of each of the blocks, so we do that with the R1_sum_index windows, this will create a list of 
-        #different length, which we need to keep in mind, the windows for this will be:
-            
-        #R1_sum_blocks = [[0,1],[1,2],[2,5],[5,6],[7,9],[9,10]]
-        
-        #we then need to find the minimum of each chain of blocks, there are 4 chains here, the first is OHP1, the second is the shiploader chain, 
-        #the third is the stacker, stockpile, reclaimer chain, and the third is the sink chain. R1_min_blocks finds the ranges of blocks we need to 
-        #min for this, in this example the windows for this will be: 
-            
-        #R1_min_blocks = [[0,1],[1,2],[2,5],[5,6]]
-        
-        #Because the output of the two chains that run parallel when a skip is occuring need to be recombined at the other side, we then need to sum these two
-        #chains together, so the windows in this example will be: 
-            
-        #R2_sum_blocks = [[0,1],[1,3],[3,4]]
-        
-        #we then find the min of these blocks to get the output of the system
-        
-        
-        self.R1_sum_blocks = [] 
-        
-        self.R1_min_blocks = [[0,]]
-        
-        self.R2_sum_blocks = [[0,]]
-        
-        
-        R1_sum_index = 0
-        R1_min_index = 0
-        R2_sum_index = 0
-        
-        crt_skip = False
-        skip_over = True
-        
-        for block in self.block_list:
-            
-            self.R1_sum_blocks.append((R1_sum_index, R1_sum_index + len(self.block_list[block])))
-            
-            R1_sum_index += len(self.block_list[block])
-            R1_min_index += 1
-            
-            if block[0] in ("Skip Start","Skip End"):
-                R2_sum_index += 1
-                if len(self.R1_min_blocks[-1]) == 1:
-                    self.R2_sum_blocks[-1].append(R2_sum_index)
-                    self.R2_sum_blocks.append([R2_sum_index, ])
-                    self.R1_min_blocks[-1].append(R1_min_index-1)
-                    self.R1_min_blocks.append([R1_min_index-1,])
-                else:
-                    self.R1_min_blocks.append([R1_min_index-1,])
-                if crt_skip == False:
-                    crt_skip = block[1]
-                    skip_over = False
-                else:
-                    crt_skip = False
-                    
-            elif skip_over == False:
-                R2_sum_index += 1
-                self.R1_min_blocks[-1].append(R1_min_index-1)
-                self.R1_min_blocks.append([R1_min_index-1,])
-                skip_over = True
-        
-        self.R1_sum_blocks.pop()
-        self.R1_min_blocks.pop()
-        self.R2_sum_blocks.pop()
-        
-        self.total_throughput_calced = False
-        self.total_throughput = {}
-        
-        self.IOF_calced = False
-        self.IOF = {}
-        
-        # This code sets up the block info for the sample_reliability function
-        
-        #Block reliability distribution is a map that maps block and configuration to the output distribution. 
-        
-        #for example, you may have a block called "Stacker_Block_1", and it has 5 machines, and each one has a %50 of functioning, and a capacity of 1
-        #and we have taken out the first and last machine for maintainence, to get the output distribution we would use: 
-        #self.block_reliability_dist[""Stacker_Block_1""][(0,1,1,1,0)].
-        #in this case it will return : {0: 0.125, 1: 0.375, 2: 0.375, 3: 0.125,}
-        #the way you read this map, is the key is the throughput of the block, and the value is probability of that throughput
-        
-        self.block_reliability_dist = {}
-        
-        for block in self.block_list:
+        failures = [1,]*len(self.system.machine_values[0])
+        for index in offline:
+            failures[index] = 0
+        return tuple(failures)
+    
+    def class_representative(self, offline):
+        """
+        Returns the offline machine indices of the configuration that configuration_options (with classes) keeps in place of the 
+        given one, that is the one with the same number of machines offline in each class, but the first machines of each class.
+        """
+        offline = set(offline)
+        representative = []
+        index = 0
+        for block in self.system.block_list:
+            machines = len(self.system.block_list[block])
             if block[0] == "Skip End":
-                self.block_reliability_dist[block[1]+"_end"] = {(0,) : {0.0: 1.0}}
-                continue
-            self.block_reliability_dist[block[1]] = {}
-            machine_count = len(self.block_list[block])
-            for configuration in range(2**machine_count):
-                mask = tuple(int2bin(configuration, machine_count))
-                self.block_reliability_dist[block[1]][mask] = {}
-                new_selection = []
-                for v, c in zip(self.block_list[block], mask):
-                    if c == 0:
-                        continue
-                    new_selection.append((v[1], v[2]))
-                for combination in range(2**len(new_selection)):
-                    com_mask = int2bin(combination, len(new_selection))
-                    new_val = sum(np.multiply(com_mask, [x[0] for x in new_selection]))
-                    if not new_val in self.block_reliability_dist[block[1]][mask]: 
-                        self.block_reliability_dist[block[1]][mask][new_val] = 0
-                    self.block_reliability_dist[block[1]][mask][new_val] += np.prod(np.abs(np.array([x[1] for x in new_selection])-np.array(com_mask)))
-        
-        
-    def sample_total_throughput(self, failures):
+                representative.extend(position for position in range(index, index+machines) if position in offline)
+            else:
+                for machine_class in self.system.block_reliability_dist[block[1]].classes:
+                    count = sum(1 for position in machine_class[2] if index+position in offline)
+                    representative.extend(index+position for position in machine_class[2][:count])
+            index += machines
+        return tuple(srt(representative))
+    
+    def machine_positions(self, machines):
         """
-        Takes around 1.2 seconds to complete 100000 iterations of the basic one (10 machines)
-        Takes around 3.4 seconds to complete 100000 iterations of the more complex one (41 machines)
-        We expect the complexity to increase linearly.
+        Turns a list of machines, by their names in the Component column or their indices (in machine_values order), into the 
+        sorted tuple of their indices
+        """
+        positions = set()
+        for machine in machines:
+            if isinstance(machine, str):
+                if not machine in self.system.machine_names:
+                    raise KeyError(machine)
+                positions.add(self.system.machine_names.index(machine))
+            else:
+                positions.add(int(machine))
+        return tuple(srt(list(positions)))
+    
+    def throughput_over_time(self, times, lifetimes, offline = ()):
+        """
+        Returns the throughput distribution of the system at each of the given times, where the machines given a lifetime 
+        distribution are down at time t with probability F(t) - F(t - TTR), the chance they failed within the time it takes to 
+        repair them, as in the EventSpaceMethod. The other machines keep the Availability from the csv file at every time.
 
         Parameters
         ----------
-        failures : TYPE
-            DESCRIPTION.
+        times : array(float)
+            the times to find the distribution at, for example np.arange(365) for a year of days
+        lifetimes : map
+            {Component : (failure function, TTR)}, the failure function is a ReliabilityFunctions.FailureFunction, or anything 
+            with an intg function that takes an array of times, and TTR is the time to repair, in the same units as times.
+        offline : list(string or int), optional
+            the machines that are offline (being maintained) at every time, see machine_positions. The default is ().
 
         Returns
         -------
-        None.
+        CurveDistribution
+            the throughput distribution at each time, see System.sample_reliability_curve
 
         """
-        
-        mask = failures
-        vals = [x * y for x,y in zip(mask, self.machine_values[0])]
-        R1_sums = [sum(vals[window[0]:window[1]]) for window in self.R1_sum_blocks]
-        R1_mins = [min(R1_sums[window[0]:window[1]]) for window in self.R1_min_blocks]
-        R2_sums = [sum(R1_mins[window[0]:window[1]]) for window in self.R2_sum_blocks]
-        
-        return min(R2_sums)
-        
+        times = np.asarray(times, dtype = float)
+        POF = np.repeat(self.system.machine_values[1][:, None], len(times), axis = 1)
+        for machine, (failure_function, TTR) in lifetimes.items():
+            POF[self.machine_positions([machine])[0]] = np.clip(failure_function.intg(times) - failure_function.intg(times - TTR), 0, 1)
+        return self.system.sample_reliability_curve(self.configuration_failures(self.machine_positions(offline)), POF)
     
-        
-    def combine_operation(dist_1, dist_2):
+    def query(self, offline, index = None):
         """
-        This function is used to calcualte the throughput of two throughput distributions in parallel, being combined
+        Returns the throughput distribution of the system with the given machines offline (and the rest working), looked up in a 
+        throughput table index if it is there (see index_throughput_table), or worked out with System.sample_reliability if not.
 
         Parameters
         ----------
-        dist_1 : map
-            the first throughput distirbution 
-        dist_2 : map
-            the second throughput distirbution 
+        offline : list(string or int)
+            the machines that are offline, see machine_positions
+        index : ThroughputIndex or string, optional
+            the index to look in, or its path. An index of a table made with classes is looked up by the class representative of 
+            the configuration (see class_representative). The default is None, to always use sample_reliability.
 
         Returns
         -------
-        Options : map
-            the resulting throughput distribution
+        DiscreteDistribution
+            the distribution of the total throughput
 
         """
-        Options = {}
-        for M1 in dist_1:
-            for M2 in dist_2:
-                nxt = M1 + M2
-                if not nxt in Options:
-                    Options[nxt] = 0
-                Options[nxt] += dist_1[M1]*dist_2[M2]
-        Options = {x:Options[x] for x in srt(list(Options))}
-        return Options
+        positions = self.machine_positions(offline)
         
+        if index is not None:
+            if isinstance(index, str):
+                if not index in self.indexes:
+                    self.indexes[index] = ThroughputIndex(index)
+                index = self.indexes[index]
+            words = (len(self.system.machine_values[0])+63)//64
+            for key in (positions, self.class_representative(positions)):
+                dist = index.get(offline_key(key, words))
+                if dist is not None:
+                    return dist
         
-    def following_operation(dist_1, dist_2):
+        return self.system.sample_reliability(self.configuration_failures(positions))
+    
+    def write_throughput_rows(self, file, rows, file_format):
         """
-        This function is used to calcualte the throughput of two throughput distributions in series
+        Writes a chunk of (offline machine indices, distribution) rows to a throughput table, see generate_throughput_table
+        """
+        if file_format == "csv":
+            names = self.system.machine_names
+            writer = csv.writer(file)
+            for offline, dist in rows:
+                writer.writerow([";".join(names[index] for index in offline),
+                                 "".join(str(c) for c in self.configuration_failures(offline)),
+                                 repr(float(dist.expected())),
+                                 ";".join(repr(x) for x in dist.support.tolist()),
+                                 ";".join(repr(x) for x in dist.probs.tolist())])
+            return
+        words = (len(self.system.machine_values[0])+63)//64
+        keys = np.array([offline_key(offline, words) for offline, dist in rows], dtype = "<u8").reshape(len(rows), words)
+        lengths = np.array([len(dist.support) for offline, dist in rows], dtype = "<u8")
+        support = np.concatenate([dist.support for offline, dist in rows]).astype("<f8")
+        probs = np.concatenate([dist.probs for offline, dist in rows]).astype("<f8")
+        file.write(np.array([len(rows), len(support)], dtype = "<u8").tobytes())
+        for array in (keys, lengths, support, probs):
+            file.write(array.tobytes())
+    
+    def estimate_throughput_table(self, depth, file_format = "csv", calibration = 50, classes = False):
+        """
+        Estimates the size of the throughput table generate_throughput_table would create, and the time it would take, 
+        by timing a random sample of the configurations.
 
         Parameters
         ----------
-        dist_1 : map
-            the first throughput distirbution 
-        dist_2 : map
-            the second throughput distirbution 
+        depth : int
+            for each block, how many can be offline at any given time
+        file_format : string, optional
+            "csv" or "bin", see generate_throughput_table. The default is "csv".
+        calibration : int, optional
+            the number of configurations to time. The default is 50.
+        classes : boolean, optional
+            whether the table only has one configuration for each number of identical machines offline, see configuration_options. 
+            The default is False.
 
         Returns
         -------
-        Options : map
-            the resulting throughput distribution
-
-        """
-        Options = []
-        total_min = min(max(dist_1), max(dist_2))
-        for M1 in dist_1:
-            if M1 > total_min:
-                break
-            Options.append(M1)
-        for M2 in dist_2:
-            if M2 > total_min:
-                break
-            if M2 in Options:
-                continue
-            Options.append(M2)
-        Options = {x:0 for x in srt(Options)}
-        for M1 in dist_1:
-            for M2 in dist_2:
-                if M1 == M2:
-                    Options[M1] += dist_1[M1]*dist_2[M2]
-                if M1 > M2:
-                    Options[M2] += dist_1[M1]*dist_2[M2]
-                if M2 > M1:
-                    Options[M1] += dist_1[M1]*dist_2[M2]
-        
-        return Options
+        rows : int
+            the number of rows in the table
+        size : float
+            the estimated size of the file in bytes
+        runtime : float
+            the estimated time to create the table in seconds
 
-    def sample_reliability(self, failures):
         """
-        Sample reliability returns the throughput distribution, given a failures list.
+        options = self.configuration_options(depth, classes)
+        rows = math.prod(len(option) for option in options)
+        
+        sample = []
+        rng = np.random.default_rng(0)
+        for x in range(min(calibration, rows)):
+            sample.append(tuple(itertools.chain.from_iterable(option[rng.integers(len(option))] for option in options)))
+        
+        start = time.perf_counter()
+        sample = [(offline, self.system.sample_reliability(self.configuration_failures(offline))) for offline in sample]
+        runtime = (time.perf_counter() - start)/len(sample)
         
-        runs 100000 iterations in 2.25 seconds with the basic model (10 machines)
-        runs 100000 iterations in 37.68 deconds for the more complex model (41 machines)
-        runs 100000 iterations in 167.33 seconds for the even more complex model (83 machines)
+        if file_format == "csv":
+            file = io.StringIO()
+        else:
+            file = io.BytesIO()
+        self.write_throughput_rows(file, sample, file_format)
+        size = len(file.getvalue())/len(sample)
         
-        If this becomes an issue there is another way of doing this that speeds it up for more complex examples.
+        return rows, size*rows, runtime*rows
+    
+    def generate_throughput_table(self, depth, warning = False, filename = None, file_format = "csv", chunk_size = 10000, classes = False):
+        """
+        Creates the throughput table, which has the throughput distribution (from System.sample_reliability) of every maintenance 
+        configuration where at most depth machines are offline in each block.
+        The rows are written chunk_size at a time, so the memory used does not grow with the size of the table.
+        
+        The csv format has a row for each configuration, with the columns
+            Offline : the names of the offline machines, seperated by ;
+            Mask : the failures list given to sample_reliability, as a string of 0s and 1s
+            Expected : the expected throughput
+            Throughput : the throughputs of the distribution, seperated by ;
+            Probability : the probability of each throughput, seperated by ;
+        The bin format stores the same distributions as columns of binary arrays, see read_throughput_table.
         
         Parameters
         ----------
-        failures : tuple(int)
-            The list of failures/machines being repaired, 0 indicates that it is not currently in operation, and 1 otherwise.
-
-        Returns
-        -------
-        map
-            returns a map in the same format that block_reliability_dist has, where the keys are the throughput, and the value is the 
-            probability of that throughput
+        depth : int
+            for each layer, how many can be offline at any given time
+        warning : boolean, OPTIONAL
+            depending on the depth, and number of nodes, the operation may take a very long time,
+            and/or create a very large file select true to get a warning of the time it will take.
+            The table is then not created, the estimate is printed and returned (see estimate_throughput_table),
+            call this again with warning False to create it. The default is False.
+        filename : string, optional
+            the path of the table to create. The default is the csv file name, with _depth_(depth).(file_format) on the end.
+        file_format : string, optional
+            "csv" or "bin". The default is "csv".
+        chunk_size : int, optional
+            the number of rows that are written at a time. The default is 10000.
+        classes : boolean, optional
+            if True, configurations that only differ in which of a set of identical machines are offline only get one row, see 
+            configuration_options. The default is False.
+
+        Returns
+        -------
+        tuple or None
+            if warning is True, the estimate (rows, size, runtime) from estimate_throughput_table, otherwise None.
+
+        """
+        if file_format not in ("csv", "bin"):
+            raise ValueError("file_format must be csv or bin, not " + str(file_format))
+        if filename is None:
+            filename = os.path.splitext(self.filename)[0] + "_depth_" + str(depth) + ("_classes" if classes else "") + "." + file_format
+        
+        if warning:
+            rows, size, runtime = self.estimate_throughput_table(depth, file_format, classes = classes)
+            print("The table will have", rows, "rows, take up around", round(size/1e6, 2), "MB, and take around", round(runtime, 1), "seconds to create")
+            return rows, size, runtime
+        
+        options = self.configuration_options(depth, classes)
+        
+        #the table is written to a temporary file that is only given its name once it is complete, so an interrupted run does not 
+        #leave a table that looks complete
+        with open_table(filename + ".tmp", file_format) as file:
+            self.write_throughput_header(file, file_format)
+            self.write_throughput_range(file, options, 0, math.prod(len(option) for option in options), file_format, chunk_size)
+        os.replace(filename + ".tmp", filename)
+    
+    def generate_throughput_table_parallel(self, depth, processes = None, filename = None, file_format = "csv", chunk_size = 10000, 
+                                           shard_size = 100000, keep_shards = False, classes = False):
+        """
+        Creates the same throughput table as generate_throughput_table, but with a pool of processes.
+        
+        The configurations are split into shards of shard_size consecutive configurations (in the order generate_throughput_table 
+        writes them), each worker process writes the shards it is given to its own file in the folder (filename).shards, and once
+        every shard is done they are joined together in order into filename.
+        A shard file is only given its final name once it is complete, so if the run is interrupted, running it again with the same
+        arguments skips the shards that are already done. The folder has a manifest.json of the model (the key of the csv file, 
+        see handle_csv) and the arguments the shards were made with, if it does not match the arguments of the new run the old 
+        shards are deleted rather than joined into the new table.
+
+        Parameters
+        ----------
+        depth : int
+            for each block, how many can be offline at any given time
+        processes : int, optional
+            the number of worker processes. The default is None, which uses os.cpu_count().
+        filename : string, optional
+            the path of the table to create. The default is the csv file name, with _depth_(depth).(file_format) on the end.
+        file_format : string, optional
+            "csv" or "bin". The default is "csv".
+        chunk_size : int, optional
+            the number of rows that are written at a time. The default is 10000.
+        shard_size : int, optional
+            the number of configurations in each shard. The default is 100000.
+        keep_shards : boolean, optional
+            if False the shard folder is deleted once the table has been joined together. The default is False.
+        classes : boolean, optional
+            see generate_throughput_table. The default is False.
+
+        Returns
+        -------
+        None.
+
+        """
+        if file_format not in ("csv", "bin"):
+            raise ValueError("file_format must be csv or bin, not " + str(file_format))
+        if filename is None:
+            filename = os.path.splitext(self.filename)[0] + "_depth_" + str(depth) + ("_classes" if classes else "") + "." + file_format
+        
+        rows = math.prod(len(option) for option in self.configuration_options(depth, classes))
+        shard_folder = filename + ".shards"
+        
+        manifest = {"key" : self.key, "depth" : depth, "classes" : classes, "file_format" : file_format, "shard_size" : shard_size, 
+                    "rows" : rows}
+        manifest_filename = os.path.join(shard_folder, "manifest.json")
+        if os.path.isdir(shard_folder):
+            try:
+                with open(manifest_filename) as file:
+                    old_manifest = json.load(file)
+            except (OSError, ValueError):
+                old_manifest = None
+            if old_manifest != manifest:
+                shutil.rmtree(shard_folder)
+        if not os.path.isdir(shard_folder):
+            os.makedirs(shard_folder)
+            with open(manifest_filename + ".tmp", mode = 'w') as file:
+                json.dump(manifest, file)
+            os.replace(manifest_filename + ".tmp", manifest_filename)
+        
+        shards = [os.path.join(shard_folder, "shard_" + str(shard).zfill(8) + "." + file_format) for shard in range(math.ceil(rows/shard_size))]
+        
+        todo = [(depth, classes, start, min(start+shard_size, rows), path, file_format, chunk_size) 
+                for start, path in zip(range(0, rows, shard_size), shards) if not os.path.exists(path)]
+        
+        if todo:
+            with multiprocessing.Pool(processes, initializer = _init_shard_worker, initargs = (self.filename, self.system.resolution, self.system.threshold)) as pool:
+                for path in pool.imap_unordered(_generate_shard, todo):
+                    pass
+        
+        with open_table(filename + ".tmp", file_format) as file:
+            self.write_throughput_header(file, file_format)
+            for path in shards:
+                with open(path, mode = 'rb') as shard:
+                    if file_format == "csv":
+                        file.flush()
+                        shutil.copyfileobj(shard, file.buffer)
+                    else:
+                        shutil.copyfileobj(shard, file)
+        os.replace(filename + ".tmp", filename)
+        
+        if not keep_shards:
+            shutil.rmtree(shard_folder)
+        
+    def configuration_at(self, options, index):
+        """
+        Returns the offline machine indices of configuration number index, numbering the configurations in the order
+        itertools.product(*options) would give them (the last block changes the fastest).
+        """
+        offline = []
+        for option in reversed(options):
+            index, digit = divmod(index, len(option))
+            offline.extend(reversed(option[digit]))
+        return tuple(reversed(offline))
+    
+    def write_throughput_header(self, file, file_format):
+        """
+        Writes the header of a throughput table, see generate_throughput_table
+        """
+        if file_format == "csv":
+            csv.writer(file).writerow(["Offline", "Mask", "Expected", "Throughput", "Probability"])
+        else:
+            file.write(TABLE_MAGIC)
+            file.write(np.array([len(self.system.machine_values[0]), (len(self.system.machine_values[0])+63)//64], dtype = "<u8").tobytes())
+    
+    def write_throughput_range(self, file, options, start, stop, file_format, chunk_size):
+        """
+        Writes the rows of configurations number start to stop (see configuration_at) to a throughput table, chunk_size rows at a time
+        """
+        #consecutive configurations only differ in the last few blocks, so the incremental evaluator saves redoing the first ones
+        evaluator = IncrementalEvaluator(self.system)
+        rows = []
+        for index in range(start, stop):
+            offline = self.configuration_at(options, index)
+            rows.append((offline, evaluator.sample_reliability(self.configuration_failures(offline))))
+            if len(rows) == chunk_size:
+                self.write_throughput_rows(file, rows, file_format)
+                rows = []
+        if rows:
+            self.write_throughput_rows(file, rows, file_format)
+
+
+class DiscreteDistribution(Mapping):
+    def __init__(self, support, probs, residual = 0.0):
+        """
+        This class represents a throughput distribution, it is stored as a sorted array of the throughputs (the support), and an array
+        of the probability of each of those throughputs.
+        It behaves like the maps that were used for the distributions before, so dist[throughput] returns the probability of that
+        throughput, and iterating over it gives the throughputs in order.
+
+        Parameters
+        ----------
+        support : array(float)
+            the possible throughputs, sorted, with no repeats
+        probs : array(float)
+            the probability of each of the throughputs in support
+        residual : float, optional
+            the probability that has been dropped from the distribution by truncate (or from the distributions it was built from), 
+            so probs adds up to 1 - residual. The default is 0.0.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.support = np.asarray(support, dtype = float)
+        self.probs = np.asarray(probs, dtype = float)
+        self.residual = residual
+        self._tail = None
+        self._cumulative = None
+        
+    def from_map(dist):
+        """
+        Converts a map distribution {throughput: probability} into a DiscreteDistribution, if it is already one it is returned as is.
+        """
+        if isinstance(dist, DiscreteDistribution):
+            return dist
+        support = np.array(list(dist), dtype = float)
+        probs = np.array([dist[x] for x in dist], dtype = float)
+        return DiscreteDistribution.merge(support, probs)
+    
+    def merge(support, probs):
+        """
+        Builds a DiscreteDistribution from a support that may be unsorted or contain repeats, adding up the probabilities of repeated throughputs.
+        """
+        support, inverse = np.unique(support, return_inverse = True)
+        return DiscreteDistribution(support, np.bincount(inverse.ravel(), weights = probs.ravel(), minlength = len(support)))
+    
+    def __getitem__(self, value):
+        index = np.searchsorted(self.support, value)
+        if index == len(self.support) or self.support[index] != value:
+            raise KeyError(value)
+        return self.probs[index]
+    
+    def __iter__(self):
+        return iter(self.support.tolist())
+    
+    def __len__(self):
+        return len(self.support)
+    
+    def __repr__(self):
+        if self.residual:
+            return "DiscreteDistribution(" + repr(dict(zip(self.support.tolist(), self.probs.tolist()))) + ", residual = " + repr(self.residual) + ")"
+        return "DiscreteDistribution(" + repr(dict(zip(self.support.tolist(), self.probs.tolist()))) + ")"
+    
+    def combine(self, other):
+        """
+        The distribution of the sum of two independent throughputs, used for two paths in parallel being combined.
+        Every pair of throughputs is added at once with an outer sum, then the repeated sums are merged.
+        """
+        dist = DiscreteDistribution.merge(np.add.outer(self.support, other.support), np.multiply.outer(self.probs, other.probs))
+        dist.residual = self.joint_residual(other)
+        return dist
+    
+    def following(self, other):
+        """
+        The distribution of the minimum of two independent throughputs, used for two blocks in series.
+        As P(min >= x) = P(X1 >= x)*P(X2 >= x), the probability of each throughput can be found from the tails of the two 
+        distributions, which only needs the union of the two supports rather than every pair.
+        """
+        total_min = min(self.support[-1], other.support[-1])
+        support = np.concatenate((self.support, other.support))
+        support.sort(kind = "stable")
+        support = support[:support.searchsorted(total_min, "right")]
+        support = support[np.concatenate(([True], support[1:] != support[:-1]))]
+        
+        tail_1 = self.tail()
+        tail_2 = other.tail()
+        
+        at_least = tail_1[self.support.searchsorted(support, "left")]*tail_2[other.support.searchsorted(support, "left")]
+        more_than = tail_1[self.support.searchsorted(support, "right")]*tail_2[other.support.searchsorted(support, "right")]
+        
+        return DiscreteDistribution(support, np.maximum(at_least - more_than, 0), self.joint_residual(other))
+    
+    def combine_adjoint(self, other, out, adjoint):
+        """
+        The backward step of combine, used by System.importance. Given out = self.combine(other), and adjoint, the derivative of an
+        expected value with respect to each probability in out, returns the derivatives with respect to the probabilities in self and
+        in other. As P(out = z) is the sum of P(self = x)*P(other = y) over x + y = z, this is the adjoint at x + y summed over the 
+        other distribution.
+        """
+        grid = adjoint[self.sum_index(other, out)]
+        return grid @ other.probs, self.probs @ grid
+    
+    def sum_index(self, other, out):
+        """
+        Returns the matrix of the index in out.support of each sum of a throughput of self and a throughput of other
+        """
+        return out.support.searchsorted(np.add.outer(self.support, other.support))
+    
+    def following_adjoint(self, other, out, adjoint):
+        """
+        The backward step of following, see combine_adjoint. P(out = z) is found from the tails of the two distributions, 
+        P(self >= z)*P(other >= z) - P(self > z)*P(other > z), so the derivatives are found for the tails first, then as each
+        tail is the sum of the probabilities from there up, the derivative for each probability is the sum of the derivatives of
+        the tails at and below it.
+        """
+        tail_1 = self.tail()
+        tail_2 = other.tail()
+        
+        left_1 = self.support.searchsorted(out.support, "left")
+        right_1 = self.support.searchsorted(out.support, "right")
+        left_2 = other.support.searchsorted(out.support, "left")
+        right_2 = other.support.searchsorted(out.support, "right")
+        
+        d_tail_1 = (np.bincount(left_1, weights = adjoint*tail_2[left_2], minlength = len(tail_1)) 
+                    - np.bincount(right_1, weights = adjoint*tail_2[right_2], minlength = len(tail_1)))
+        d_tail_2 = (np.bincount(left_2, weights = adjoint*tail_1[left_1], minlength = len(tail_2)) 
+                    - np.bincount(right_2, weights = adjoint*tail_1[right_1], minlength = len(tail_2)))
+        
+        return d_tail_1.cumsum()[:-1], d_tail_2.cumsum()[:-1]
+    
+    def joint_residual(self, other):
+        """
+        The probability missing from a distribution built from this one and other, as only the pairs of throughputs that are 
+        both still in them are counted.
+        """
+        return 1 - (1 - self.residual)*(1 - other.residual)
+    
+    def truncate(self, threshold):
+        """
+        Returns the distribution with the throughputs that have a probability below threshold removed, their probability is 
+        added to residual instead. The most likely throughput is always kept.
+        """
+        if self.probs.min() >= threshold:
+            return self
+        keep = self.probs >= threshold
+        keep[self.probs.argmax()] = True
+        return DiscreteDistribution(self.support[keep], self.probs[keep], self.residual + float(self.probs[~keep].sum()))
+    
+    def tail(self):
+        """
+        Returns the array of P(throughput >= support[i]) for each i, with a 0 on the end, it is only calculated the first time it is needed.
+        """
+        if self._tail is None:
+            self._tail = np.zeros(len(self.probs)+1)
+            self._tail[:-1] = self.probs[::-1].cumsum()[::-1]
+        return self._tail
+    
+    def cumulative(self):
+        """
+        Returns the array of P(throughput <= support[i-1]) for each i, with a 0 at the start, so P(throughput <= x) is at
+        support.searchsorted(x, "right"). It is only calculated the first time it is needed.
+        """
+        if self._cumulative is None:
+            self._cumulative = np.zeros(self.probs.shape[:-1] + (self.probs.shape[-1]+1,))
+            self._cumulative[..., 1:] = self.probs.cumsum(axis = -1)
+        return self._cumulative
+    
+    def cdf(self, x):
+        """
+        Returns P(throughput <= x), x can be a number or an array of them, found with a binary search of the support.
+        """
+        cdf = self.cumulative()[..., self.support.searchsorted(x, "right")]
+        return float(cdf) if np.ndim(cdf) == 0 else cdf
+    
+    def exceedance(self, x):
+        """
+        Returns P(throughput >= x), the probability of meeting a target throughput x, x can be a number or an array of them.
+        """
+        exceedance = self.tail()[..., self.support.searchsorted(x, "left")]
+        return float(exceedance) if np.ndim(exceedance) == 0 else exceedance
+    
+    def quantile(self, q):
+        """
+        Returns the smallest throughput with P(throughput <= it) >= q, q can be a number or an array of them, found with a binary
+        search of the cumulative probabilities. The probability in residual is not in the distribution, so the quantiles above 
+        1 - residual are the largest throughput.
+        """
+        q = np.asarray(q, dtype = float) - 1e-12
+        cumulative = self.cumulative()[..., 1:]
+        if cumulative.ndim == 1:
+            index = cumulative.searchsorted(q, "left")
+        else:
+            index = np.stack([row.searchsorted(q, "left") for row in cumulative])
+        return self.support[np.minimum(index, len(self.support)-1)]
+    
+    def expected(self):
+        """
+        Returns the expected throughput (of the probability that is in the distribution, see residual)
+        """
+        return self.probs @ self.support
+    
+    def stack(dists):
+        """
+        Puts a list of distributions together as a CurveDistribution, one row for each, on the union of their supports, so cdf, 
+        exceedance, quantile and expected answer every threshold for every distribution in one call, as a 
+        (distributions x thresholds) array.
+        """
+        dists = [DiscreteDistribution.from_map(dist) for dist in dists]
+        support = np.unique(np.concatenate([dist.support for dist in dists]))
+        probs = np.zeros((len(dists), len(support)))
+        for row, dist in zip(probs, dists):
+            row[support.searchsorted(dist.support)] = dist.probs
+        return CurveDistribution(support, probs, np.array([dist.residual for dist in dists], dtype = float))
+    
+
+class GridDistribution(DiscreteDistribution):
+    def __init__(self, probs, resolution, error = 0.0, residual = 0.0):
+        """
+        This class is a throughput distribution where the throughputs are all on a grid, multiples of resolution, stored as a dense 
+        array, so probs[i] is the probability of a throughput of i*resolution. It is what System uses when it is given a resolution,
+        as then combining two distributions is a convolution of two arrays, and the arrays can never be longer than the total
+        capacity of the system divided by the resolution, no matter how many different capacities there are.
+        
+        The capacities of the machines are rounded to the grid, so the throughput of each outcome can be a little off, error is
+        an upper bound on how far off it can be. It is added up when two distributions are combined, and the larger one is kept
+        when they are in series, so the error of the output of a system is at most the rounding error of the machines of its 
+        largest path.
+
+        Parameters
+        ----------
+        probs : array(float)
+            the probability of each multiple of resolution, starting from 0
+        resolution : float
+            the spacing of the grid
+        error : float, optional
+            the most the throughput of any outcome can be off by. The default is 0.0.
+        residual : float, optional
+            see DiscreteDistribution. The default is 0.0.
+
+        Returns
+        -------
+        None.
+
+        """
+        DiscreteDistribution.__init__(self, np.arange(len(probs))*resolution, probs, residual)
+        self.resolution = resolution
+        self.error = error
+        
+    def combine(self, other):
+        """
+        The distribution of the sum of two independent throughputs on the same grid, see DiscreteDistribution.combine
+        """
+        return GridDistribution(np.convolve(self.probs, other.probs), self.resolution, self.error + other.error, self.joint_residual(other))
+    
+    def following(self, other):
+        """
+        The distribution of the minimum of two independent throughputs on the same grid, see DiscreteDistribution.following
+        """
+        n = min(len(self.probs), len(other.probs))
+        tail_1 = self.tail()
+        tail_2 = other.tail()
+        probs = tail_1[:n]*tail_2[:n] - tail_1[1:n+1]*tail_2[1:n+1]
+        return GridDistribution(np.maximum(probs, 0), self.resolution, max(self.error, other.error), self.joint_residual(other))
+    
+    def sum_index(self, other, out):
+        """
+        Returns the matrix of the index in out of each sum of a throughput of self and a throughput of other, which on a grid is
+        just the sum of their indices
+        """
+        return np.add.outer(np.arange(len(self.probs)), np.arange(len(other.probs)))
+    
+    def truncate(self, threshold):
+        """
+        Returns the distribution with the probabilities below threshold set to 0 and added to residual, see DiscreteDistribution.truncate
+        """
+        drop = (self.probs < threshold) & (self.probs > 0)
+        drop[self.probs.argmax()] = False
+        if not drop.any():
+            return self
+        probs = np.where(drop, 0, self.probs)
+        return GridDistribution(probs[:np.flatnonzero(probs)[-1]+1], self.resolution, self.error, self.residual + float(self.probs[drop].sum()))
+    
+    def __repr__(self):
+        return "GridDistribution(" + repr(dict(zip(self.support.tolist(), self.probs.tolist()))) + ", error = " + repr(self.error) + ", residual = " + repr(self.residual) + ")"
+    
+
+class CurveDistribution(DiscreteDistribution):
+    def __init__(self, support, probs, residual = 0.0):
+        """
+        This class is a throughput distribution at each of a number of times, all on the same support, so probs[i, j] is the 
+        probability of a throughput of support[j] at time i. It is what System.sample_reliability_curve returns, as the operations
+        on the distributions are done for every time at once, a curve over a year of days costs about as much as one call of 
+        sample_reliability with longer arrays, rather than 365 calls. It is also used for a number of distributions stacked together
+        (see DiscreteDistribution.stack), as cdf, exceedance, quantile and expected work on every row at once.
+
+        Parameters
+        ----------
+        support : array(float)
+            the possible throughputs, sorted, with no repeats
+        probs : array(float)
+            times x len(support), the probability of each throughput at each time
+        residual : float or array(float), optional
+            the probability dropped at each time, see DiscreteDistribution. The default is 0.0.
+
+        Returns
+        -------
+        None.
+
+        """
+        DiscreteDistribution.__init__(self, support, probs, residual)
+        self.probs = np.atleast_2d(self.probs)
+        
+    def __repr__(self):
+        return "CurveDistribution(support = " + repr(self.support.tolist()) + ", times = " + repr(len(self.probs)) + ")"
+    
+    def at(self, time):
+        """
+        Returns the distribution at time number time, as a DiscreteDistribution
+        """
+        residual = self.residual[time] if np.ndim(self.residual) else self.residual
+        return DiscreteDistribution(self.support, self.probs[time], float(residual))
+    
+    def combine(self, other):
+        """
+        The distribution of the sum of two independent throughputs at each time, see DiscreteDistribution.combine. The repeated 
+        sums are merged for every time at once, by giving each time its own range of bins.
+        """
+        support, inverse = np.unique(np.add.outer(self.support, other.support), return_inverse = True)
+        products = (self.probs[:, :, None]*other.probs[:, None, :]).reshape(max(len(self.probs), len(other.probs)), -1)
+        bins = (np.arange(len(products))[:, None]*len(support) + inverse.ravel()).ravel()
+        probs = np.bincount(bins, weights = products.ravel(), minlength = len(products)*len(support)).reshape(len(products), len(support))
+        return CurveDistribution(support, probs, self.joint_residual(other))
+    
+    def following(self, other):
+        """
+        The distribution of the minimum of two independent throughputs at each time, see DiscreteDistribution.following
+        """
+        support = np.union1d(self.support, other.support)
+        support = support[:support.searchsorted(min(self.support[-1], other.support[-1]), "right")]
+        
+        tail_1 = self.tail()
+        tail_2 = other.tail()
+        
+        at_least = tail_1[:, self.support.searchsorted(support, "left")]*tail_2[:, other.support.searchsorted(support, "left")]
+        more_than = tail_1[:, self.support.searchsorted(support, "right")]*tail_2[:, other.support.searchsorted(support, "right")]
+        
+        return CurveDistribution(support, np.maximum(at_least - more_than, 0), self.joint_residual(other))
+    
+    def truncate(self, threshold):
+        """
+        Returns the distribution with the throughputs that have a probability below threshold at every time removed, see
+        DiscreteDistribution.truncate
+        """
+        peak = self.probs.max(axis = 0)
+        if peak.min() >= threshold:
+            return self
+        keep = peak >= threshold
+        keep[peak.argmax()] = True
+        return CurveDistribution(self.support[keep], self.probs[:, keep], self.residual + self.probs[:, ~keep].sum(axis = 1))
+    
+    def tail(self):
+        """
+        Returns the array of P(throughput >= support[i]) at each time, see DiscreteDistribution.tail
+        """
+        if self._tail is None:
+            self._tail = np.zeros((len(self.probs), len(self.support)+1))
+            self._tail[:, :-1] = self.probs[:, ::-1].cumsum(axis = 1)[:, ::-1]
+        return self._tail
+    
+
+class BlockDistribution:
+    def __init__(self, machines, cache_size = 1024, resolution = None, threshold = None):
+        """
+        This class maps the maintenance configurations of a single block to the output distribution of that block, it is used as 
+        System.block_reliability_dist[block id][configuration].
+        The distributions are built the first time a configuration is looked up, and the cache_size most recently used ones are kept.
+        
+        Parameters
+        ----------
+        machines : list
+            the machines in the block, [(MachineID, Capacity, POF), ...]
+        cache_size : int, optional
+            the number of configurations to keep the distributions of. The default is 1024.
+        resolution : float, optional
+            if given, the capacities are rounded to multiples of resolution, and the distributions are GridDistributions. 
+            The default is None.
+        threshold : float, optional
+            if given, the distributions are truncated to it when they are built, see DiscreteDistribution.truncate. The default is None.
+            
+        the cache is an OrderedDict, with the most recently used configuration last.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.machines = machines
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        
+        #Machines with the same capacity and POF are interchangeable, which of them are offline does not change the distribution, 
+        #only how many of them. So the machines are split into classes of identical machines, (Capacity, POF, positions in the block),
+        #and the distributions are kept by the number of machines of each class that are online (see class_key), so a block of 10
+        #identical machines has 11 distributions rather than 2^10.
+        classes = {}
+        for position, machine in enumerate(machines):
+            classes.setdefault((machine[1], machine[2]), []).append(position)
+        self.classes = [(capacity, POF, positions) for (capacity, POF), positions in classes.items()]
+        self.class_of = [0,]*len(machines)
+        for index, machine_class in enumerate(self.classes):
+            for position in machine_class[2]:
+                self.class_of[position] = index
+        
+        #the capacity of each class in multiples of resolution, and how far that is from the real capacity
+        self.resolution = resolution
+        self.threshold = threshold
+        if resolution is not None:
+            self.units = [int(round(machine_class[0]/resolution)) for machine_class in self.classes]
+            self.errors = [abs(machine_class[0] - units*resolution) for machine_class, units in zip(self.classes, self.units)]
+        
+        #the distributions loaded from a saved model (see System.save), maps each class key to the support and probs arrays
+        self.stored = {}
+        
+    def class_key(self, configuration):
+        """
+        Returns the number of machines of each class that are online in the configuration, which is what the distribution is kept 
+        under. If every machine is in a class of its own this is just the configuration.
+        """
+        if len(self.classes) == len(self.machines):
+            return tuple(configuration)
+        counts = [0,]*len(self.classes)
+        for c, index in zip(configuration, self.class_of):
+            counts[index] += c
+        return tuple(counts)
+        
+    def __getitem__(self, configuration):
+        if len(configuration) != len(self.machines):
+            raise KeyError(configuration)
+        counts = self.class_key(configuration)
+        
+        dist = self.cache.get(counts)
+        if dist is not None:
+            self.cache.move_to_end(counts)
+            return dist
+        
+        if counts in self.stored:
+            support, probs = self.stored[counts]
+            if self.resolution is not None:
+                dist = GridDistribution(probs, self.resolution, self.error(counts))
+            else:
+                dist = DiscreteDistribution(support, probs)
+            if self.threshold is not None: #it was saved after it was truncated
+                dist.residual = max(0.0, 1.0 - float(probs.sum()))
+        else:
+            dist = self.build(counts)
+            if self.threshold is not None:
+                dist = dist.truncate(self.threshold)
+        self.cache[counts] = dist
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last = False)
+        return dist
+    
+    def __contains__(self, configuration):
+        return len(configuration) == len(self.machines) and all(c in (0, 1) for c in configuration)
+        
+    def build(self, counts):
+        """
+        Builds the output distribution of the block. The number of machines of a class that are working is binomial, so the output 
+        of each class is its capacity times a binomial distribution, and these are combined one class at a time. This takes 
+        (classes) x (distinct throughputs) steps, rather than the 2^machines it takes to go through every combination.
+
+        Parameters
+        ----------
+        counts : tuple(int)
+            the number of machines of each class that are not offline (being maintained), see class_key.
+
+        Returns
+        -------
+        DiscreteDistribution
+            the output distribution of the block
+
+        """
+        dist = None
+        for index, ((capacity, POF, positions), count) in enumerate(zip(self.classes, counts)):
+            working = np.arange(count+1)
+            binomial = np.array([math.comb(count, k) for k in working], dtype = float)*(1-POF)**working*POF**(count-working)
+            if self.resolution is not None:
+                part = GridDistribution(np.bincount(working*self.units[index], weights = binomial), self.resolution, count*self.errors[index])
+            else:
+                part = DiscreteDistribution(working*capacity, binomial)
+            dist = part if dist is None else dist.combine(part)
+        
+        if dist is None: #a block with no machines
+            if self.resolution is not None:
+                return GridDistribution(np.ones(1), self.resolution)
+            return DiscreteDistribution(np.zeros(1), np.ones(1))
+        return dist
+    
+    def curve(self, configuration, POF):
+        """
+        Builds the output distribution of the block at a number of times, given the probability of each machine being down at 
+        each time, see System.sample_reliability_curve. As in build, the machines that have the same capacity, and the same POF at
+        every time, are combined as a binomial.
+
+        Parameters
+        ----------
+        configuration : tuple(int)
+            1 for each machine that is not offline (being maintained), 0 otherwise
+        POF : array(float)
+            machines x times, the probability of each machine being down at each time
+
+        Returns
+        -------
+        CurveDistribution
+            the output distribution of the block at each time
+
+        """
+        groups = {}
+        for position, (machine, c) in enumerate(zip(self.machines, configuration)):
+            if c:
+                groups.setdefault((machine[1], POF[position].tobytes()), (machine[1], POF[position], []))[2].append(position)
+        
+        dist = CurveDistribution(np.zeros(1), np.ones((POF.shape[1], 1)))
+        for capacity, down, positions in groups.values():
+            working = np.arange(len(positions)+1)
+            binomial = (np.array([math.comb(len(positions), k) for k in working], dtype = float)
+                        *(1-down[:, None])**working*down[:, None]**(len(positions)-working))
+            dist = dist.combine(CurveDistribution(working*capacity, binomial))
+        if self.threshold is not None:
+            dist = dist.truncate(self.threshold)
+        return dist
+    
+    def error(self, counts):
+        """
+        Returns the most the throughput of the block can be off by from rounding the capacities of the machines that are not offline
+        to multiples of resolution.
+        """
+        return float(sum(count*error for count, error in zip(counts, self.errors)))
+
+
+class System:
+    def __init__(self, block_list, cache_size = 1024, resolution = None, threshold = None):
+        """
+        Parameters
+        ----------
+        block_list : {map(list)}
+            contains entries containing ("Block", "Block identifyer"): [(MachineID, Capacity, POF), ...]
+            or
+            tuples containing ("Skip Start", "Skip id") :[(MachineID, Capacity, POF), ...]
+            with a corresponding ("Skip End", "Skip id") : [] when it ends
+            The entries must be ordered as they are connected.
+        cache_size : int, optional
+            the number of configurations of each block to keep the output distribution of. The default is 1024.
+        resolution : float, optional
+            if given, the capacities are rounded to multiples of resolution (50 t/h for example) and the throughput distributions are 
+            dense arrays on that grid (see GridDistribution), so they never have more than (total capacity)/resolution + 1 entries.
+            The distributions then have an error attribute, the most the throughput can be off by from the rounding. 
+            The default is None, for exact distributions.
+        threshold : float, optional
+            if given, throughputs with a probability below threshold are dropped from every distribution as it is built, and the
+            probability dropped is kept in its residual attribute (see DiscreteDistribution.truncate), so the probabilities of the 
+            output add up to 1 - residual. The default is None, for no truncation.
+        """
+        
+        self.block_list = block_list
+        self.resolution = resolution
+        self.threshold = threshold
+        
+        self.machine_names = list(itertools.chain.from_iterable([[machine[0] for machine in self.block_list[block]] for block in self.block_list]))
+        
+        #this array contains the two important parameters for each machine, indexed at the index of the machine
+        self.machine_values = np.array([list(itertools.chain.from_iterable([[machine[1] for machine in self.block_list[block]] for block in self.block_list])), #Capacity
+                                        list(itertools.chain.from_iterable([[machine[2] for machine in self.block_list[block]] for block in self.block_list]))])#POF
+        
+        # This section of code sets up the windows used in the sample_total_throughput function
+        
+        # The way these work is like so, if we take the example_model, and line up all its machines you get this:
+        
+        #OHP1, Ship_loader_1, Stacker_1, Stacker_2, Stacker_3, Stockpile_1, Relcaimer_1, Reclaimer_2, Reclaimer_3, Sink_1
+        
+        #We want to start by summing up the capacities of each of the blocks, so we do that with the R1_sum_index windows, this will create a list of 
+        #different length, which we need to keep in mind, the windows for this will be:
+            
+        #R1_sum_blocks = [[0,1],[1,2],[2,5],[5,6],[7,9],[9,10]]
+        
+        #we then need to find the minimum of each chain of blocks, there are 4 chains here, the first is OHP1, the second is the shiploader chain, 
+        #the third is the stacker, stockpile, reclaimer chain, and the third is the sink chain. R1_min_blocks finds the ranges of blocks we need to 
+        #min for this, in this example the windows for this will be: 
+            
+        #R1_min_blocks = [[0,1],[1,2],[2,5],[5,6]]
+        
+        #Because the output of the two chains that run parallel when a skip is occuring need to be recombined at the other side, we then need to sum these two
+        #chains together, so the windows in this example will be: 
+            
+        #R2_sum_blocks = [[0,1],[1,3],[3,4]]
+        
+        #we then find the min of these blocks to get the output of the system
+        
+        
+        self.R1_sum_blocks = [] 
+        
+        self.R1_min_blocks = [[0,]]
+        
+        self.R2_sum_blocks = [[0,]]
+        
+        
+        R1_sum_index = 0
+        R1_min_index = 0
+        R2_sum_index = 0
+        
+        crt_skip = False
+        skip_over = True
+        
+        for block in self.block_list:
+            
+            self.R1_sum_blocks.append((R1_sum_index, R1_sum_index + len(self.block_list[block])))
+            
+            R1_sum_index += len(self.block_list[block])
+            R1_min_index += 1
+            
+            if block[0] in ("Skip Start","Skip End"):
+                R2_sum_index += 1
+                if len(self.R1_min_blocks[-1]) == 1:
+                    self.R2_sum_blocks[-1].append(R2_sum_index)
+                    self.R2_sum_blocks.append([R2_sum_index, ])
+                    self.R1_min_blocks[-1].append(R1_min_index-1)
+                    self.R1_min_blocks.append([R1_min_index-1,])
+                else:
+                    self.R1_min_blocks.append([R1_min_index-1,])
+                if crt_skip == False:
+                    crt_skip = block[1]
+                    skip_over = False
+                else:
+                    crt_skip = False
+                    
+            elif skip_over == False:
+                R2_sum_index += 1
+                self.R1_min_blocks[-1].append(R1_min_index-1)
+                self.R1_min_blocks.append([R1_min_index-1,])
+                skip_over = True
+        
+        self.R1_sum_blocks.pop()
+        self.R1_min_blocks.pop()
+        self.R2_sum_blocks.pop()
+
+        #The batched version of sample_total_throughput does the same segmented reductions over these windows, but for many masks at once.
+        #The first sum is done as a matrix product, each column of R1_sum_matrix holds the capacities of the machines in that window, and 0 elsewhere.
+        #The min and second sum use reduceat, which reduces between consecutive indices, so each window [start, end] is flattened into
+        #start, end, start, end, ... and only every second output is kept.
+        
+        self.R1_sum_matrix = np.zeros((len(self.machine_values[0]), len(self.R1_sum_blocks)))
+        for index, window in enumerate(self.R1_sum_blocks):
+            self.R1_sum_matrix[window[0]:window[1], index] = self.machine_values[0][window[0]:window[1]]
+        self.R1_min_index = np.array(self.R1_min_blocks, dtype = int).ravel()
+        self.R2_sum_index = np.array(self.R2_sum_blocks, dtype = int).ravel()
+        
+        self.total_throughput_calced = False
+        self.total_throughput = {}
+        
+        self.IOF_calced = False
+        self.IOF = {}
+        
+        # This code sets up the block info for the sample_reliability function
+        
+        #Block reliability distribution is a map that maps block and configuration to the output distribution. 
+        
+        #for example, you may have a block called "Stacker_Block_1", and it has 5 machines, and each one has a %50 of functioning, and a capacity of 1
+        #and we have taken out the first and last machine for maintainence, to get the output distribution we would use: 
+        #self.block_reliability_dist[""Stacker_Block_1""][(0,1,1,1,0)].
+        #in this case it will return : {0: 0.125, 1: 0.375, 2: 0.375, 3: 0.125,}
+        #the way you read this map, is the key is the throughput of the block, and the value is probability of that throughput
+        
+        #The distributions are not all built up front, as there are 2^n configurations for a block with n machines. Instead each block gets a 
+        #BlockDistribution, which builds the distribution for a configuration the first time it is looked up, and keeps the most recently
+        #used ones in a cache of size cache_size.
+        
+        self.block_reliability_dist = {}
+        
+        for block in self.block_list:
+            if block[0] == "Skip End":
+                self.block_reliability_dist[block[1]+"_end"] = {(0,) : DiscreteDistribution([0.0], [1.0])}
+                continue
+            self.block_reliability_dist[block[1]] = BlockDistribution(self.block_list[block], cache_size, resolution, threshold)
+        
+        self.plan = self.compile_plan()
+        
+        #the windows of sample_total_throughput can not represent a skip inside another skip
+        self.nested_skips = max(itertools.accumulate((step[0] == OPEN) - (step[0] == CLOSE) for step in self.plan), default = 0) > 1
+        
+        #the combined paths of the skips, see sample_reliability
+        self.cache_size = cache_size
+        self.subtree_cache = OrderedDict()
+        
+        
+    def sample_total_throughput(self, failures):
+        """
+        Takes around 1.2 seconds to complete 100000 iterations of the basic one (10 machines)
+        Takes around 3.4 seconds to complete 100000 iterations of the more complex one (41 machines)
+        We expect the complexity to increase linearly.
+
+        Parameters
+        ----------
+        failures : TYPE
+            DESCRIPTION.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.nested_skips:
+            raise ValueError("the system has a skip inside another skip, which sample_total_throughput can not evaluate, use sample_capacity")
+        
+        mask = failures
+        vals = [x * y for x,y in zip(mask, self.machine_values[0])]
+        R1_sums = [sum(vals[window[0]:window[1]]) for window in self.R1_sum_blocks]
+        R1_mins = [min(R1_sums[window[0]:window[1]]) for window in self.R1_min_blocks]
+        R2_sums = [sum(R1_mins[window[0]:window[1]]) for window in self.R2_sum_blocks]
+        
+        return min(R2_sums)
+
+    def sample_total_throughput_batch(self, failures, chunk_size = 65536):
+        """
+        The batched version of sample_total_throughput, this evaluates a whole array of failure masks at once, using
+        segmented reductions over the same windows sample_total_throughput uses. Like sample_total_throughput, it raises a ValueError
+        if the system has a skip inside another skip, see sample_capacity_batch for those.
+
+        Takes around 0.5 seconds to complete 1000000 masks of the more complex one (41 machines)
+        Takes around 1.1 seconds to complete 1000000 masks of the even more complex one (81 machines)
+
+        Parameters
+        ----------
+        failures : array(int)
+            a 2d array of failure masks, each row is a scenario, and each column is a machine, in the same order as machine_values.
+            0 indicates that the machine is not currently in operation, and 1 otherwise. A single 1d mask is also accepted.
+        chunk_size : int, optional
+            the number of rows that are evaluated at a time, this bounds the size of the temporary arrays. The default is 65536.
+
+        Returns
+        -------
+        array(float)
+            the throughput of each of the rows of failures.
+
+        """
+        if self.nested_skips:
+            raise ValueError("the system has a skip inside another skip, which sample_total_throughput_batch can not evaluate, use sample_capacity_batch")
+        failures = np.asarray(failures)
+        if failures.ndim == 1:
+            failures = failures[np.newaxis, :]
+
+        throughput = np.empty(len(failures))
+        for start in range(0, len(failures), chunk_size):
+            mask = failures[start:start+chunk_size]
+            
+            #the extra column at the end of these is padding, so the end of the last window is still a valid index
+            R1_sums = np.zeros((len(mask), self.R1_sum_matrix.shape[1]+1))
+            np.matmul(mask.astype(np.float64), self.R1_sum_matrix, out = R1_sums[:, :-1])
+            
+            R1_mins = np.zeros((len(mask), len(self.R1_min_blocks)+1))
+            R1_mins[:, :-1] = np.minimum.reduceat(R1_sums, self.R1_min_index, axis = 1)[:, ::2]
+            
+            R2_sums = np.add.reduceat(R1_mins, self.R2_sum_index, axis = 1)[:, ::2]
+            
+            throughput[start:start+chunk_size] = R2_sums.min(axis = 1)
+            
+        return throughput
+
+    
+        
+    def combine_operation(dist_1, dist_2):
+        """
+        This function is used to calcualte the throughput of two throughput distributions in parallel, being combined
+
+        Parameters
+        ----------
+        dist_1 : DiscreteDistribution or map
+            the first throughput distirbution 
+        dist_2 : DiscreteDistribution or map
+            the second throughput distirbution 
+
+        Returns
+        -------
+        DiscreteDistribution
+            the resulting throughput distribution
+
+        """
+        return DiscreteDistribution.from_map(dist_1).combine(DiscreteDistribution.from_map(dist_2))
+        
+        
+    def following_operation(dist_1, dist_2):
+        """
+        This function is used to calcualte the throughput of two throughput distributions in series
+
+        Parameters
+        ----------
+        dist_1 : DiscreteDistribution or map
+            the first throughput distirbution 
+        dist_2 : DiscreteDistribution or map
+            the second throughput distirbution 
+
+        Returns
+        -------
+        DiscreteDistribution
+            the resulting throughput distribution
+
+        """
+        return DiscreteDistribution.from_map(dist_1).following(DiscreteDistribution.from_map(dist_2))
+    
+    def following(self, dist_1, dist_2):
+        """
+        following_operation, with the result truncated to the threshold of the system, if it has one
+        """
+        if self.threshold is None:
+            return System.following_operation(dist_1, dist_2)
+        return System.following_operation(dist_1, dist_2).truncate(self.threshold)
+    
+    def combine(self, dist_1, dist_2):
+        """
+        combine_operation, with the result truncated to the threshold of the system, if it has one
+        """
+        if self.threshold is None:
+            return System.combine_operation(dist_1, dist_2)
+        return System.combine_operation(dist_1, dist_2).truncate(self.threshold)
 
+    def sample_reliability(self, failures):
         """
+        Sample reliability returns the throughput distribution, given a failures list.
         
-        #Options is just the slives of the failures that correspond to each block, so options[0] would return something like (1,0,1), which are is
-        #the slice of the failues list that corresponds to the first blocks machines, of which in this case there are 3.
+        Benchmark.py measures how many failures lists a second this runs at, on the example models and on generated models of up
+        to 1000 machines.
         
-        options = []
+        Parameters
+        ----------
+        failures : tuple(int)
+            The list of failures/machines being repaired, 0 indicates that it is not currently in operation, and 1 otherwise.
+
+        Returns
+        -------
+        DiscreteDistribution
+            returns a distribution in the same format that block_reliability_dist has, it can be used as a map where the keys are the 
+            throughput, and the value is the probability of that throughput
+
+        """
+        
+        #the skips whose slice of the failures list is the same as in an earlier call are not run again, their paths are taken from 
+        #subtree_cache instead (see split_branches)
+        state = EMPTY_STATE
         index = 0
-        block_index = 0
-        while index < len(self.machine_values[0]):
-            nxt = len(self.block_list[list(self.block_list.keys())[block_index]])
-            options.append(tuple(failures[index:index+nxt]))
-            index += nxt
-            block_index += 1
-        
-        #This algorithm works by keeping track of 3 paths, the main, the continuation, and the skip path.
-        #If we are not currently up to a block which is either skipped over, or a skip block, we just use the 
-        #following function to add the next block to the main path,
-        #if we are in a skip block, we add it to the skip path, and if a block is currently being skipped over, we add
-        #it to the continuation path.
-        #if we get to the end of a skip path, we combine the two paths, then use the following function to add it back to the 
-        #main path.
-        
-        Main_Path = self.block_reliability_dist[list(self.block_reliability_dist.keys())[0]][options[0]]
-        Continuation = {}
-        Continuation_Stockpiled = False
-        Skip = {}
-        Skip_Stockpiled = False
-        Skipping = False
-        
-        for block_index, block in enumerate(list(self.block_list.keys())[1:]):
-            
-            if Skipping == True and block[0] == "Skip End": #if we reach the end of the skip 
-                if Continuation_Stockpiled == False and Skip_Stockpiled == False:
-                    Continuation = System.combine_operation(Continuation, Skip)
-                    Main_Path = System.following_operation(Main_Path, Continuation)
-                if Continuation_Stockpiled == True and Skip_Stockpiled == False:
-                    Main_Path = System.following_operation(Main_Path, Skip)
-                    Main_Path = System.combine_operation(Main_Path, Continuation)
-                if Continuation_Stockpiled == False and Skip_Stockpiled == True:
-                    Main_Path = System.following_operation(Main_Path, Continuation)
-                    Main_Path = System.combine_operation(Main_Path, Skip)
-                if Continuation_Stockpiled == True and Skip_Stockpiled == True:
-                    Main_Path = System.combine_operation(Skip, Continuation)
-                    
-                Continuation = {}
-                Continuation_Stockpiled = False
-                Skip = {}
-                Skip_Stockpiled = False
-                Skipping = False
-                
+        while index < len(self.plan):
+            step = self.plan[index]
+            opcode, start, stop, table, match = step
+            if opcode == OPEN:
+                parts = self.subtree_cache.get((index, tuple(failures[start:stop])))
+                if parts is not None:
+                    self.subtree_cache.move_to_end((index, tuple(failures[start:stop])))
+                    state = System.join(state[0], state[1], parts, self.following, self.combine) + (state[2],)
+                    index = match + 1
+                    continue
+            elif opcode == CLOSE:
+                Path, Stockpiled, Frames = state
+                Upstream, Upstream_Stockpiled, Branches = Frames[-1]
+                parts = System.split_branches(Branches + ((Path, Stockpiled),), self.combine)
+                self.subtree_cache[(match, tuple(failures[self.plan[match][1]:self.plan[match][2]]))] = parts
+                if len(self.subtree_cache) > self.cache_size:
+                    self.subtree_cache.popitem(last = False)
+                state = System.join(Upstream, Upstream_Stockpiled, parts, self.following, self.combine) + (Frames[:-1],)
+                index += 1
                 continue
+            state = self.next_state(state, step, tuple(failures[start:stop]))
+            index += 1
+        return state[0]
+    
+    def sample_reliability_curve(self, failures, POF):
+        """
+        Returns the throughput distribution at each of a number of times, given a failures list, and the probability of each machine
+        being down at each time (rather than the fixed POF of each machine that sample_reliability uses). The plan is run once, on
+        CurveDistributions, so the work for every time is done together in numpy.
+        
+        The capacity grid (resolution) is not used here, the distributions are exact, but the threshold is.
+
+        Parameters
+        ----------
+        failures : tuple(int)
+            The list of failures/machines being repaired, 0 indicates that it is not currently in operation, and 1 otherwise.
+        POF : array(float)
+            machines x times, the probability of each machine being down at each time, in machine_values order.
+
+        Returns
+        -------
+        CurveDistribution
+            the throughput distribution at each time
+
+        """
+        POF = np.asarray(POF, dtype = float)
+        if POF.ndim == 1:
+            POF = POF[:, None]
+        state = EMPTY_STATE
+        for opcode, start, stop, table, match in self.plan:
+            value = None
+            if table is not None:
+                value = table.curve(tuple(failures[start:stop]), POF[start:stop])
+            state = System.apply_step(state, opcode, value, self.following, self.combine)
+        return state[0]
+    
+    def split_failures(self, failures):
+        """
+        Splits the failures list into the slices that correspond to each step of the plan, so options[0] would return 
+        something like (1,0,1), which is the slice of the failures list that corresponds to the first blocks machines, of which in this 
+        case there are 3. The steps that are not blocks (the start, end and next path of a skip) get an empty slice, as what they do 
+        only depends on the state they are given.
+        """
+        return [tuple(failures[step[1]:step[2]]) if step[3] is not None else () for step in self.plan]
+    
+    #The system is a series-parallel network: a path is a list of blocks in series, and a skip is a set of paths in parallel, 
+    #the skip path, and the continuation path (the blocks being skipped over), which can have more skips on them, so a skip can
+    #be inside another skip.
+    #When there are no skips we just use the following function to add the next block to the path.
+    #If a skip starts, the path so far is put on a stack, and each path of the skip is built up on its own from its first block.
+    #At the end of the skip, the paths of the skip are combined, then the following function is used to add them back to the 
+    #path on the top of the stack.
+    #A stockpile resets the path it is on to just the output of the stockpile, as the blocks before it can not hold it up. So the paths
+    #of a skip with a stockpile on them are combined with the rest after the following function instead, and if every path of a skip 
+    #has a stockpile on it, the path after the skip does not depend on the blocks before it either.
+    
+    #Which of these happens at each block only depends on the order of the blocks, not the failures list, so it is worked out once
+    #by compile_plan, which turns the tree of paths and skips into a list of steps (opcode, start, stop, table, match), run in order.
+    #The opcodes are
+    #    SERIES, STOCKPILE : add the block to the path, or reset the path to the block
+    #    OPEN : the start of a skip, put the path on the stack
+    #    NEXT_BRANCH : the end of one path of a skip, and the start of the next
+    #    CLOSE : the end of a skip, combine its paths and add them back to the path from the stack
+    #start:stop is the slice of the failures list for the blocks machines (for OPEN, the machines of the whole skip), table is the 
+    #blocks entry in block_reliability_dist (None if it is not a block), and match is the index of the matching CLOSE step for an OPEN
+    #step, and of the matching OPEN step for a CLOSE step.
+    #The state the plan is run on is the tuple (Path, Stockpiled, Frames), the current path, whether it has a stockpile on it, and the
+    #stack of skips it is in, each (the path before the skip, whether that has a stockpile on it, the finished paths of the skip).
+    
+    def compile_plan(self):
+        """
+        Works out the plan sample_reliability follows, see the comment above.
+        
+        A skip starts at a "Skip Start" block, and the "Skip Start" blocks right after it are added to the skip path, as long as the 
+        path so far has no "Skip End" of its own (handle_csv only ends a skip path at its last block). A "Skip Start" block right after 
+        a path that does is the start of another skip, on the continuation path of the first. The blocks after the skip path are the 
+        continuation path, until the "Skip End" block of the skip. A skip inside another skip has to end before or at the same place 
+        as the outer skip, otherwise the skips cross, which is not a series-parallel network, and a ValueError is raised, as it is for
+        a "Skip End" of a skip that has already ended. Skips that have not ended by the last block are ended there.
+
+        Returns
+        -------
+        list(tuple)
+            the list of steps (opcode, start, stop, table, match).
+
+        """
+        plan = []
+        index = 0
+        Frames = [] #the skips that have started but not ended, as [index of the OPEN step, ids of the skip blocks, still on the skip path,
+                    #id of the last skip block]
+        Ended = set()
+        
+        def close(position):
+            Frame = Frames.pop()
+            if Frame[2]: #nothing was skipped over
+                plan.append((NEXT_BRANCH, position, position, None, None))
+            plan.append((CLOSE, position, position, None, Frame[0]))
+            plan[Frame[0]] = (OPEN, plan[Frame[0]][1], position, None, len(plan)-1)
+            Ended.update(Frame[1])
+            return Frame
+        
+        for block in self.block_list:
+            start = index
+            index += len(self.block_list[block])
             
-            block_index += 1
-            nxt_dist = self.block_reliability_dist[block[1]][options[block_index]]
-            
-            if Skipping == False and block[0] != "Skip Start":
-                if block[1][:9] == "Stockpile":
-                    Main_Path = nxt_dist
+            if block[0] == "Skip End":
+                if any(block[1] in Frame[1] for Frame in Frames):
+                    if not block[1] in Frames[-1][1]:
+                        raise ValueError("the skip " + str(block[1]) + " ends inside a skip that started after it, skips can not cross")
+                    close(start)
+                elif block[1] in Ended:
+                    raise ValueError("the skip " + str(block[1]) + " was already ended by the end of another skip")
                 else:
-                    Main_Path = System.following_operation(Main_Path, nxt_dist)
-                    
+                    raise ValueError("the skip " + str(block[1]) + " ends before it starts")
+                continue
+            
             if block[0] == "Skip Start":
-                if block[1][:9] == "Stockpile":
-                    Skip_Stockpiled = True
-                if Skipping == False:
-                    Skip = nxt_dist
-                if Skipping == True :
-                    if block[1][:9] == "Stockpile":
-                        Skip = nxt_dist
-                    else:
-                        Skip = System.following_operation(Skip, nxt_dist)
-                Skipping = True
-                        
-            if Skipping == True and block[0] == "Block":
-                if block[1][:9] == "Stockpile":
-                    Continuation_Stockpiled = True
-                if Continuation == {}:
-                    Continuation = nxt_dist
+                #the skip path so far has its own end if it is a different skip, so this block starts a skip on the continuation path
+                if Frames and Frames[-1][2] and not ("Skip End", Frames[-1][3]) in self.block_list:
+                    Frames[-1][1].add(block[1])
+                    Frames[-1][3] = block[1]
                 else:
-                    if block[1][:9] == "Stockpile":
-                        Continuation = nxt_dist
-                    else:
-                        Continuation = System.following_operation(Continuation, nxt_dist)
-        return Main_Path
+                    if Frames and Frames[-1][2]:
+                        Frames[-1][2] = False
+                        plan.append((NEXT_BRANCH, start, start, None, None))
+                    Frames.append([len(plan), {block[1]}, True, block[1]])
+                    plan.append((OPEN, start, None, None, None))
+            elif Frames and Frames[-1][2]:
+                Frames[-1][2] = False
+                plan.append((NEXT_BRANCH, start, start, None, None))
+                
+            opcode = STOCKPILE if block[1][:9] == "Stockpile" else SERIES
+            plan.append((opcode, start, index, self.block_reliability_dist[block[1]], None))
+        
+        while Frames:
+            close(index)
+            
+        return plan
+    
+    def next_state(self, state, step, option):
+        """
+        Returns the state (Path, Stockpiled, Frames) after a step of the plan, given the state before it, and the steps slice of 
+        the failures list
+        """
+        if step[3] is None:
+            return System.apply_step(state, step[0], None, self.following, self.combine)
+        return System.apply_step(state, step[0], step[3][option], self.following, self.combine)
+    
+    def apply_step(state, opcode, value, following, combine):
+        """
+        Applies one step of the plan to a state (Path, Stockpiled, Frames), where value is the output of the steps block.
+        following and combine are the series and parallel operations, so the same plan can be run on distributions 
+        (following and combine) or on plain throughputs (min, +).
+        """
+        Path, Stockpiled, Frames = state
+        
+        if opcode == SERIES:
+            return (value if Path is None else following(Path, value), Stockpiled, Frames)
+        if opcode == STOCKPILE:
+            return (value, True, Frames)
+        if opcode == OPEN:
+            return (None, False, Frames + ((Path, Stockpiled, ()),))
+        
+        Upstream, Upstream_Stockpiled, Branches = Frames[-1]
+        Branches = Branches + ((Path, Stockpiled),)
+        if opcode == NEXT_BRANCH:
+            return (None, False, Frames[:-1] + ((Upstream, Upstream_Stockpiled, Branches),))
+        
+        parts = System.split_branches(Branches, combine)
+        return System.join(Upstream, Upstream_Stockpiled, parts, following, combine) + (Frames[:-1],)
+    
+    def split_branches(Branches, combine):
+        """
+        Combines the finished paths of a skip, given as (path, has a stockpile on it), into (dependent, independent), the combined 
+        output of the paths that are held up by the blocks before the skip, and of the ones that are not. Either is None if there are 
+        no such paths. Neither depends on anything before the skip, so they can be saved and reused (see sample_reliability).
+        """
+        dependent = None
+        independent = None
+        for Path, Stockpiled in Branches:
+            if Path is None:
+                continue
+            if Stockpiled:
+                independent = Path if independent is None else combine(independent, Path)
+            else:
+                dependent = Path if dependent is None else combine(dependent, Path)
+        return dependent, independent
+    
+    def join(Path, Stockpiled, parts, following, combine):
+        """
+        Adds the combined paths of a skip, parts = (dependent, independent) from split_branches, to the path before it, and returns
+        the new (Path, Stockpiled).
+        """
+        dependent, independent = parts
+        if dependent is None:
+            return (independent, True)
+        if not Path is None:
+            dependent = following(Path, dependent)
+        if not independent is None:
+            dependent = combine(dependent, independent)
+        return (dependent, Stockpiled)
+    
+    def sample_capacity(self, failures):
+        """
+        Returns the throughput of the system if every machine that is not being repaired is working, by running the plan with the
+        capacity sum of each block, min for blocks in series, and + for paths in parallel.
+        As taking more machines offline can never increase the throughput, this is an upper bound on the throughput of the 
+        failures list, and of any failures list with more machines offline.
+
+        Parameters
+        ----------
+        failures : tuple(int)
+            The list of failures/machines being repaired, 0 indicates that it is not currently in operation, and 1 otherwise.
+
+        Returns
+        -------
+        float
+            the capacity of the system
+
+        """
+        vals = np.multiply(failures, self.machine_values[0])
+        state = EMPTY_STATE
+        for step in self.plan:
+            state = System.apply_step(state, step[0], vals[step[1]:step[2]].sum(), min, operator.add)
+        return state[0]
+
+    def sample_capacity_batch(self, failures, chunk_size = 65536):
+        """
+        The batched version of sample_capacity, this runs the plan once for a whole array of failures lists, with the capacity
+        sum of each block for every row at once, np.minimum for blocks in series, and np.add for paths in parallel.
+
+        Parameters
+        ----------
+        failures : array(int)
+            a 2d array of failures lists, each row is a scenario, and each column is a machine, in the same order as machine_values.
+            0 indicates that the machine is not currently in operation, and 1 otherwise. A single 1d failures list is also accepted.
+        chunk_size : int, optional
+            the number of rows that are evaluated at a time, this bounds the size of the temporary arrays. The default is 65536.
+
+        Returns
+        -------
+        array(float)
+            the capacity of each of the rows of failures.
+
+        """
+        failures = np.asarray(failures)
+        if failures.ndim == 1:
+            failures = failures[np.newaxis, :]
+
+        #each column sums the capacities of the machines of one step of the plan
+        capacity_matrix = np.zeros((len(self.machine_values[0]), len(self.plan)))
+        for index, step in enumerate(self.plan):
+            capacity_matrix[step[1]:step[2], index] = self.machine_values[0][step[1]:step[2]]
+
+        capacity = np.empty(len(failures))
+        for start in range(0, len(failures), chunk_size):
+            vals = failures[start:start+chunk_size].astype(np.float64) @ capacity_matrix
+            state = EMPTY_STATE
+            for index, step in enumerate(self.plan):
+                state = System.apply_step(state, step[0], vals[:, index], np.minimum, np.add)
+            capacity[start:start+chunk_size] = 0 if state[0] is None else state[0]
+        return capacity
+
+    def importance(self, failures = None):
+        """
+        Returns the Birnbaum and criticality importance of every machine, and the expected throughput lost by taking it offline, 
+        from one pass forward through the plan, and one pass back.
+        
+        Every block is used once in the system, so the output distribution depends linearly on the distribution of each block, and 
+        the expected throughput is the sum over x of P(block = x)*E[throughput | block = x]. The forward pass runs the plan like 
+        sample_reliability, and keeps every distribution it builds (the paths up to each block). The backward pass then works out
+        E[throughput | value] for each value of each of them, from the end of the plan back (the rest of the system after each block),
+        see DiscreteDistribution.following_adjoint and combine_adjoint. So the expected throughput with a machine offline only needs
+        the distribution of its block with it offline, instead of running the whole system again for every machine.
+
+        Parameters
+        ----------
+        failures : tuple(int), optional
+            the maintenance configuration to work out the importances in, see sample_reliability. The default is None, for every 
+            machine online.
+
+        Returns
+        -------
+        map
+            "expected" : the expected throughput
+            "capacity" : the throughput if every machine is working, see sample_capacity
+            "birnbaum" : array, E[throughput | machine working] - E[throughput | machine failed], for each machine
+            "criticality" : array, birnbaum*POF/(capacity - expected), the share of the expected throughput lost to failures that
+                is down to each machine
+            "loss" : array, the expected throughput lost by taking each machine offline, which is (1-POF)*birnbaum
+            all the arrays are in machine_values order, and are 0 for the machines that are offline in failures.
+
+        """
+        machine_count = len(self.machine_values[0])
+        if failures is None:
+            failures = (1,)*machine_count
+        failures = tuple(failures)
+        
+        tape = [] #each operation of the forward pass, (backward step, dist_1, dist_2, output)
+        def following(dist_1, dist_2):
+            out = System.following_operation(dist_1, dist_2)
+            tape.append((dist_1.following_adjoint, dist_1, dist_2, out))
+            return out
+        def combine(dist_1, dist_2):
+            out = System.combine_operation(dist_1, dist_2)
+            tape.append((dist_1.combine_adjoint, dist_1, dist_2, out))
+            return out
+        
+        blocks = []
+        state = EMPTY_STATE
+        for step in self.plan:
+            value = None if step[3] is None else step[3][failures[step[1]:step[2]]]
+            if value is not None:
+                blocks.append((step, value))
+            state = System.apply_step(state, step[0], value, following, combine)
+        output = state[0]
+        expected = float(output.expected())
+        
+        #adjoints maps each distribution (by id, they are all kept alive by the tape) to E[throughput | value] for each of its values
+        adjoints = {id(output) : output.support}
+        for backward, dist_1, dist_2, out in reversed(tape):
+            if not id(out) in adjoints: #it was reset by a stockpile
+                continue
+            for dist, adjoint in zip((dist_1, dist_2), backward(dist_2, out, adjoints[id(out)])):
+                adjoints[id(dist)] = adjoints[id(dist)] + adjoint if id(dist) in adjoints else adjoint
+        
+        loss = np.zeros(machine_count)
+        for step, value in blocks:
+            if not id(value) in adjoints:
+                continue
+            adjoint = adjoints[id(value)]
+            option = failures[step[1]:step[2]]
+            for position in range(len(option)):
+                if option[position] == 0:
+                    continue
+                down = step[3][option[:position] + (0,) + option[position+1:]]
+                #the throughputs of the block with a machine offline are all throughputs of the block with it online, unless the 
+                #distributions have been truncated, then the ones that are not are left out
+                index = np.minimum(value.support.searchsorted(down.support), len(value.support)-1)
+                found = value.support[index] == down.support
+                loss[step[1]+position] = expected - float(np.dot(adjoint[index[found]], down.probs[found]))
+        
+        POF = np.asarray(self.machine_values[1], dtype = float)
+        birnbaum = np.divide(loss, 1 - POF, out = np.zeros(machine_count), where = POF < 1)
+        capacity = float(self.sample_capacity(failures))
+        if capacity > expected:
+            criticality = birnbaum*POF/(capacity - expected)
+        else:
+            criticality = np.zeros(machine_count)
+        
+        return {"expected" : expected,
+                "capacity" : capacity,
+                "birnbaum" : birnbaum,
+                "criticality" : criticality,
+                "loss" : loss}
+    
+    def optimise_maintenance(self, k, top = 5, max_per_block = None, mandatory = (), candidates = None):
+        """
+        Finds the sets of k machines that can be taken offline together with the highest expected throughput (the least expected
+        throughput lost), using branch and bound.
+        
+        The machines are tried in order of the expected throughput with just that machine offline, best first, and each set is built by 
+        adding machines later in that order. As taking more machines offline can never increase the expected throughput, a partial set 
+        is dropped as soon as an upper bound on it is no better than the top-th best full set found so far. The bounds used are, 
+        cheapest first, 
+            the expected throughput with just the next machine in the order offline
+            the capacity of the partial set (see sample_capacity)
+            the expected throughput of the partial set (sample_reliability)
+
+        Parameters
+        ----------
+        k : int
+            the number of machines to take offline, including the mandatory ones
+        top : int, optional
+            the number of plans to return. The default is 5.
+        max_per_block : int, optional
+            the most machines that can be offline in any one block. The default is None, for no limit.
+        mandatory : tuple, optional
+            the names (or indices, in machine_values order) of machines that have to be in every plan. The default is ().
+        candidates : tuple, optional
+            the names (or indices) of the machines that can be taken offline. The default is None, for every machine.
+
+        Returns
+        -------
+        list(tuple)
+            the best plans, best first, as (expected throughput, expected throughput lost, names of the offline machines)
+
+        """
+        index_of = lambda machine: self.machine_names.index(machine) if isinstance(machine, str) else int(machine)
+        machine_count = len(self.machine_values[0])
+        mandatory = srt([index_of(machine) for machine in mandatory])
+        if candidates is None:
+            candidates = range(machine_count)
+        candidates = [index_of(machine) for machine in candidates if not index_of(machine) in mandatory]
+        
+        blocks = [step for step in self.plan if step[3] is not None]
+        machine_block = np.zeros(machine_count, dtype = int)
+        for block_index, step in enumerate(blocks):
+            machine_block[step[1]:step[2]] = block_index
+        
+        def failures_of(offline):
+            failures = [1,]*machine_count
+            for index in offline:
+                failures[index] = 0
+            return failures
+        
+        def fits(offline):
+            counts = np.bincount(machine_block[list(offline)], minlength = len(blocks))
+            return max_per_block is None or counts.max(initial = 0) <= max_per_block
+        
+        if len(mandatory) > k or not fits(mandatory):
+            return []
+        
+        evaluator = IncrementalEvaluator(self)
+        def expected(offline):
+            dist = evaluator.sample_reliability(failures_of(offline))
+            return float(dist.expected())
+        
+        nominal = expected(())
+        single = {index: expected(mandatory + [index]) for index in candidates}
+        candidates.sort(key = lambda index: -single[index])
+        
+        best = [] #a min heap of (expected throughput, offline), so best[0] is the worst of the top plans found so far
+        bound = lambda: best[0][0] if len(best) == top else -math.inf
+        
+        def search(offline, position, value):
+            if len(offline) == k:
+                entry = (value, tuple(srt(list(offline))))
+                if len(best) < top:
+                    heapq.heappush(best, entry)
+                elif entry > best[0]:
+                    heapq.heapreplace(best, entry)
+                return
+            for nxt in range(position, len(candidates) - (k - len(offline)) + 1):
+                index = candidates[nxt]
+                if single[index] <= bound(): #every later machine is worse than this one
+                    return
+                chosen = offline + [index]
+                if not fits(chosen):
+                    continue
+                if self.sample_capacity(failures_of(chosen)) <= bound():
+                    continue
+                chosen_value = expected(chosen)
+                if chosen_value <= bound():
+                    continue
+                search(chosen, nxt + 1, chosen_value)
+        
+        search(list(mandatory), 0, expected(mandatory))
+        
+        best.sort(reverse = True)
+        return [(value, nominal - value, [self.machine_names[index] for index in offline]) for value, offline in best]
+    
+    def sample_reliability_batch(self, failures, order = "lexicographic", stack = False):
+        """
+        Runs sample_reliability for a whole set of failures lists, with an IncrementalEvaluator, so the work for the blocks at the start
+        that two failures lists have in common is only done once.
+        To get the most out of this the failures lists are evaluated in an order where neighbours share as many of their first blocks
+        as possible, the results are still returned in the order they were given.
+
+        Parameters
+        ----------
+        failures : array(int)
+            a 2d array of failures lists, each row is one failures list, see sample_reliability
+        order : string, optional
+            the order to evaluate the rows in, 
+                "lexicographic" sorts the rows, so rows with the same start are next to each other
+                "gray" sorts the rows by their position in the (reflected binary) Gray code, so neighbours differ in as few machines as possible
+                None evaluates them in the order given
+            The default is "lexicographic".
+        stack : boolean, optional
+            whether to return the distributions stacked together, so many thresholds can be checked against every row in one call,
+            see DiscreteDistribution.stack. The default is False.
+
+        Returns
+        -------
+        list(DiscreteDistribution) or CurveDistribution
+            the throughput distribution of each row of failures
+
+        """
+        failures = np.asarray(failures, dtype = int)
+        if order == "lexicographic":
+            sequence = np.lexsort(failures.T[::-1])
+        elif order == "gray":
+            sequence = np.lexsort(np.bitwise_xor.accumulate(failures, axis = 1).T[::-1])
+        elif order is None:
+            sequence = range(len(failures))
+        else:
+            raise ValueError("order must be lexicographic, gray or None, not " + str(order))
+        
+        evaluator = IncrementalEvaluator(self)
+        results = [None,]*len(failures)
+        for index in sequence:
+            results[index] = evaluator.sample_reliability(failures[index].tolist())
+        if stack:
+            return DiscreteDistribution.stack(results)
+        return results
 
     def sample_POC(self, failures):
         """
         Parameters
         ----------
         failures : (binary)
-            the binary of which machines are offline or not, in order of when they appear in the block_list
+            the binary of which machines are offline or not, in order of when they appear in the block_list,
+            or a 2d array with one of these on each row
 
         Returns
         -------
-        The probability that the system is in this configuration
+        The probability that the system is in this configuration (or each of the configurations)
 
         """
         
         mask = failures
         vals = np.abs(self.machine_values[1] - mask)
-        return np.prod(vals)
+        return np.prod(vals, axis = -1)
+        
+    def monte_carlo(self, n = 1000000, failures = None, quantiles = (0.05, 0.5, 0.95), bins = 50, confidence = 0.95,
+                    importance = None, seed = None, chunk_size = 65536):
+        """
+        Estimates the throughput distribution that sample_reliability finds exactly, by sampling which machines are up, chunk_size 
+        samples at a time, and running them through the plan with sample_capacity_batch.
+        
+        Each machine is up with probability 1-POF (machine_values[1]), unless it is offline in failures.
+        With importance sampling, each online machine is instead sampled as down with probability max(POF, importance), which makes
+        the states where several machines are down together come up much more often. Each sample is then weighted by
+        sample_POC(state)/(the probability of the state with the raised POFs), so the estimates are still unbiased.
+        
+        As the throughput can only take a small number of values, the (weighted) count of each one is kept, rather than every sample.
+
+        Parameters
+        ----------
+        n : int, optional
+            the number of samples. The default is 1000000.
+        failures : tuple(int), optional
+            the machines being repaired, 0 indicates that it is not currently in operation, and 1 otherwise. The default is all 1.
+        quantiles : tuple(float), optional
+            the quantiles of the throughput to estimate. The default is (0.05, 0.5, 0.95).
+        bins : int, optional
+            the number of bins in the histogram, between 0 and the throughput with every machine up. The default is 50.
+        confidence : float, optional
+            the level of the confidence intervals. The default is 0.95.
+        importance : float, optional
+            the least POF to sample each online machine with, None for no importance sampling. The default is None.
+        seed : int, optional
+            the seed of the random number generator. The default is None.
+        chunk_size : int, optional
+            the number of samples drawn at a time. The default is 65536.
+
+        Returns
+        -------
+        map
+            "mean" : the estimated expected throughput
+            "mean_ci" : (low, high) the confidence interval of the mean
+            "quantiles" : {q: (estimate, low, high)} for each of the quantiles
+            "histogram" : (edges, probs, low, high) the bin edges, and the estimated probability of each bin with its confidence interval
+            "distribution" : the estimated throughput distribution, as a DiscreteDistribution
+            "samples" : n
+
+        """
+        rng = np.random.default_rng(seed)
+        z = statistics.NormalDist().inv_cdf(0.5 + confidence/2)
+        
+        if failures is None:
+            failures = np.ones(len(self.machine_values[0]))
+        online = np.asarray(failures) == 1
+        
+        POF = self.machine_values[1]
+        sample_POF = POF if importance is None else np.where(online, np.maximum(POF, importance), POF)
+        
+        weights_by_value = {} #maps each throughput to [sum of weights, sum of weights squared]
+        for start in range(0, n, chunk_size):
+            count = min(chunk_size, n - start)
+            states = (rng.random((count, len(POF))) >= sample_POF) & online
+            throughput = self.sample_capacity_batch(states, chunk_size = count)
+            
+            if importance is None:
+                weights = np.ones(count)
+            else:
+                weights = self.sample_POC(states)/np.prod(np.abs(sample_POF - states), axis = -1)
+            
+            values, inverse = np.unique(throughput, return_inverse = True)
+            sums = np.bincount(inverse, weights = weights, minlength = len(values))
+            squares = np.bincount(inverse, weights = weights**2, minlength = len(values))
+            for value, total, square in zip(values.tolist(), sums, squares):
+                entry = weights_by_value.setdefault(value, [0, 0])
+                entry[0] += total
+                entry[1] += square
+        
+        support = np.array(srt(list(weights_by_value)))
+        probs = np.array([weights_by_value[x][0] for x in support])/n
+        squares = np.array([weights_by_value[x][1] for x in support])/n
+        distribution = DiscreteDistribution(support, probs)
+        
+        #the standard error of the mean of each samples weight x indicator(s)
+        error = lambda p, square: z*np.sqrt(np.maximum(square - p**2, 0)/n)
+        
+        mean = np.dot(support, probs)
+        mean_error = z*np.sqrt(max(np.dot(support**2, squares) - mean**2, 0)/n)
+        
+        #the quantile estimates come from the estimated cdf, and their intervals from where the cdfs confidence band crosses q
+        cdf = np.cumsum(probs)
+        cdf_error = error(cdf, np.cumsum(squares))
+        quantile_estimates = {}
+        for q in quantiles:
+            pick = lambda c: support[min(np.searchsorted(c, q - 1e-12), len(support)-1)]
+            quantile_estimates[q] = (pick(cdf), pick(cdf + cdf_error), pick(cdf - cdf_error))
+        
+        edges = np.linspace(0, self.sample_capacity_batch(np.asarray(failures))[0], bins+1)
+        bin_index = np.clip(np.searchsorted(edges, support, "right") - 1, 0, bins - 1)
+        bin_probs = np.bincount(bin_index, weights = probs, minlength = bins)
+        bin_error = error(bin_probs, np.bincount(bin_index, weights = squares, minlength = bins))
+        
+        return {"mean" : mean,
+                "mean_ci" : (mean - mean_error, mean + mean_error),
+                "quantiles" : quantile_estimates,
+                "histogram" : (edges, bin_probs, np.maximum(bin_probs - bin_error, 0), bin_probs + bin_error),
+                "distribution" : distribution,
+                "samples" : n}
+        
+    def simulate_stockpiles(self, horizon, sizes, repair_time = 24.0, replications = 1000, failures = None, initial_level = 0.5, seed = None):
+        """
+        Simulates the system over time with stockpiles that can run empty or fill up, rather than the infinite stockpiles 
+        sample_reliability assumes, where the blocks after a stockpile are never held up by the blocks before it.
+        
+        Each machine (that is not offline) is up, and down for repairs, for exponential lengths of time, with the mean time down 
+        repair_time and the mean time up set so it is up 1-POF of the time. Between two events the flow through the system is 
+        constant, it is worked out by running the plan on the capacities of the machines that are up (min in series, + in parallel),
+        with a stockpile in front of each Stockpile block
+            the fill rate is the flow of the path into the stockpile, limited to the draw rate when it is full
+            the draw rate is the capacity of the Stockpile block, limited by the blocks after it, up to the next stockpile or the end 
+            of the path it is on, and to the fill rate when it is empty
+        A stockpile at the start of a path of a skip is fed by the path before the skip (or the path before the skip it is in, if
+        that starts the path too), with what the paths of the skip that are held up by it do not take, split evenly between the 
+        stockpiles it feeds. Only a stockpile with nothing at all before it, fed straight from the source, is always full.
+        The events are machines failing or being repaired, and stockpiles running empty or filling up.
+        
+        The replications are run together, each step of the loop moves every replication on to its next event, so the work of 
+        each step is done in numpy for all of them at once. The next machine event of each replication is found with an argmin 
+        over the times each machine next changes, rather than a heap, as that is what can be done for every replication at once.
+
+        Parameters
+        ----------
+        horizon : float
+            the length of time to simulate, in the same units as repair_time (the throughputs are per unit of time)
+        sizes : float or map
+            the size of every stockpile, or {Stockpile block id : size}
+        repair_time : float or map, optional
+            the mean time to repair every machine, or {MachineID : mean time to repair}. The default is 24.0.
+        replications : int, optional
+            the number of independent runs. The default is 1000.
+        failures : tuple(int), optional
+            the machines being maintained for the whole horizon, 0 indicates that it is not in operation, and 1 otherwise. The default is all 1.
+        initial_level : float, optional
+            the level of each stockpile at the start, as a fraction of its size. The default is 0.5.
+        seed : int, optional
+            the seed of the random number generator. The default is None.
+
+        Returns
+        -------
+        map
+            "production" : the total throughput over the horizon of each replication
+            "mean_rate" : the mean throughput per unit of time, over every replication
+            "empty_fraction" : {Stockpile block id : the fraction of the horizon it was empty in each replication}
+            "full_fraction" : {Stockpile block id : the fraction of the horizon it was full in each replication}
+            "final_levels" : {Stockpile block id : its level at the end of each replication}
+            "events" : the number of events simulated, over every replication
+
+        """
+        rng = np.random.default_rng(seed)
+        machines = len(self.machine_values[0])
+        if failures is None:
+            failures = np.ones(machines)
+        online = np.asarray(failures) == 1
+        
+        POF = self.machine_values[1]
+        if isinstance(repair_time, Mapping):
+            repair = np.array([repair_time[name] for name in self.machine_names], dtype = float)
+        else:
+            repair = np.full(machines, float(repair_time))
+        with np.errstate(divide = "ignore"):
+            uptime = np.where(POF > 0, repair*(1-POF)/POF, np.inf)
+        
+        #the block steps of the plan (one for each block that is not a Skip End, in order), the matrix that sums the capacities 
+        #of the machines of each one that are up, and which of them are stockpiles
+        steps = [index for index, step in enumerate(self.plan) if step[3] is not None]
+        names = [block[1] for block in self.block_list if block[0] != "Skip End"]
+        capacity_matrix = np.zeros((machines, len(steps)))
+        for column, index in enumerate(steps):
+            start, stop = self.plan[index][1:3]
+            capacity_matrix[start:stop, column] = self.machine_values[0][start:stop]
+        column_of = {index : column for column, index in enumerate(steps)}
+        stockpiles = [index for index in steps if self.plan[index][0] == STOCKPILE]
+        stockpile_of = {index : k for k, index in enumerate(stockpiles)}
+        stockpile_names = [names[column_of[index]] for index in stockpiles]
+        if isinstance(sizes, Mapping):
+            size = np.array([sizes[name] for name in stockpile_names], dtype = float)
+        else:
+            size = np.full(len(stockpiles), float(sizes))
+        
+        #the stockpiles at the start of a path of a skip, fed_from is the index of the OPEN step of the skip whose path before
+        #it feeds them (the innermost one where that path is not empty), None for the rest. A stockpile with no path to feed it
+        #at all is fed straight from the source, so it is always full
+        fed_from = {}
+        unfed = []
+        opens = []
+        state = EMPTY_STATE
+        for index, (opcode, start, stop, table, match) in enumerate(self.plan):
+            if opcode == OPEN:
+                opens.append((index, state[0] is not None))
+            elif opcode == CLOSE:
+                opens.pop()
+            elif opcode == STOCKPILE:
+                k = stockpile_of[index]
+                fed_from[k] = None
+                if state[0] is None:
+                    fed_from[k] = next((open_index for open_index, fed in reversed(opens) if fed), None)
+                unfed.append(state[0] is None and fed_from[k] is None)
+            state = System.apply_step(state, opcode, None if table is None else 0.0, min, operator.add)
+        fed_count = {}
+        for k in fed_from:
+            if fed_from[k] is not None:
+                fed_count[fed_from[k]] = fed_count.get(fed_from[k], 0) + 1
+        
+        def run(capacity, levels, left):
+            """
+            Runs the plan on the capacities, with left the flow each skip has to give the stockpiles it feeds. Returns the state
+            at the end, the inflow and draw of each stockpile, the stockpile whose path ends at each stockpile, and for each skip 
+            that feeds stockpiles, (the flow of the paths of the skip that are held up by the path before it, the flow left over 
+            for the stockpiles, the stockpile the path before it flows from)
+            """
+            inflow = np.full(levels.shape, np.inf)
+            draw = np.zeros(levels.shape)
+            feeder = [None,]*len(stockpiles) #the stockpile whose path ends at each stockpile
+            upstream = {} #the flow of the path before each skip, and the stockpile it flows from
+            shares = {}
+            
+            #owner is the stockpile the current path flows from, the path is only made of its flow until the next stockpile or 
+            #the end of the path, where its draw is the flow of the path
+            owner = None
+            owners = []
+            def finish(value):
+                if owner is not None:
+                    draw[:, owner] = 0 if value is None else value
+                    
+            state = EMPTY_STATE
+            for index, (opcode, start, stop, table, match) in enumerate(self.plan):
+                if opcode == STOCKPILE:
+                    k = stockpile_of[index]
+                    if state[0] is not None:
+                        inflow[:, k] = state[0]
+                    elif fed_from[k] is not None:
+                        inflow[:, k] = left.get(fed_from[k], upstream[fed_from[k]])/fed_count[fed_from[k]]
+                    finish(state[0])
+                    feeder[k] = owner
+                    owner = k
+                    block = capacity[:, column_of[index]]
+                    state = (np.where(levels[:, k] > 0, block, np.minimum(block, inflow[:, k])), True, state[2])
+                    continue
+                if opcode == OPEN:
+                    upstream[index] = state[0]
+                    owners.append(owner)
+                    upstream[index, "owner"] = owner
+                    owner = None
+                elif opcode == NEXT_BRANCH:
+                    finish(state[0])
+                    owner = None
+                elif opcode == CLOSE:
+                    finish(state[0])
+                    owner = owners.pop()
+                    Upstream, Upstream_Stockpiled, Branches = state[2][-1]
+                    dependent, independent = System.split_branches(Branches + ((state[0], state[1]),), np.add)
+                    if match in fed_count:
+                        taken = 0 if dependent is None else np.minimum(Upstream, dependent)
+                        shares[match] = (taken, np.maximum(Upstream - taken, 0), upstream[match, "owner"])
+                        #everything the path before the skip brings is taken, by the paths of the skip or the stockpiles
+                        finish(Upstream)
+                        owner = None
+                    elif owner is not None:
+                        if dependent is None:
+                            finish(None)
+                            owner = None
+                        elif independent is not None:
+                            finish(np.minimum(Upstream, dependent))
+                            owner = None
+                value = None if table is None else capacity[:, column_of[index]]
+                state = System.apply_step(state, opcode, value, np.minimum, np.add)
+            finish(state[0])
+            return state, inflow, draw, feeder, shares
+        
+        def flows(up, levels):
+            """
+            Returns the output of the system, and the rate each stockpile is filling at (negative if it is emptying)
+            """
+            capacity = up @ capacity_matrix
+            
+            #what is left over for the stockpiles a skip feeds is only known at the end of the skip, after them, so the plan is 
+            #run once to find it, and again with it
+            left = {}
+            if fed_count:
+                left = {match : share[1] for match, share in run(capacity, levels, {})[4].items()}
+            state, inflow, draw, feeder, shares = run(capacity, levels, left)
+            
+            #a full stockpile only takes what is drawn from it, which holds up the path into it, so the draw of the stockpile that
+            #feeds it, these are worked out from the last stockpile back. The path before a skip that feeds stockpiles is held
+            #up by what the paths of the skip take, and what the stockpiles take
+            fill = inflow.copy()
+            fed_fill = {}
+            for k in reversed(range(len(stockpiles))):
+                for match in shares:
+                    if shares[match][2] == k:
+                        draw[:, k] = np.minimum(draw[:, k], shares[match][0] + fed_fill.get(match, 0))
+                fill[:, k] = np.where(levels[:, k] >= size[k], np.minimum(inflow[:, k], draw[:, k]), inflow[:, k])
+                if fed_from[k] is not None:
+                    fed_fill[fed_from[k]] = fed_fill.get(fed_from[k], 0) + fill[:, k]
+                elif feeder[k] is not None:
+                    draw[:, feeder[k]] = np.minimum(draw[:, feeder[k]], fill[:, k])
+            
+            output = np.zeros(len(up)) if state[0] is None else state[0]
+            return output, np.where(np.isinf(fill), 0, fill - draw)
+        
+        rows = np.arange(replications)
+        up = (rng.random((replications, machines)) >= POF) & online
+        next_change = np.where(online, rng.exponential(1, (replications, machines))*np.where(up, uptime, repair), np.inf)
+        
+        levels = np.tile(np.where(unfed, size, size*initial_level), (replications, 1))
+        
+        t = np.zeros(replications)
+        production = np.zeros(replications)
+        empty_time = np.zeros((replications, len(stockpiles)))
+        full_time = np.zeros((replications, len(stockpiles)))
+        events = 0
+        
+        while True:
+            active = t < horizon
+            if not active.any():
+                break
+            output, rate = flows(up, levels)
+            
+            machine = next_change.argmin(axis = 1)
+            machine_dt = next_change[rows, machine] - t
+            with np.errstate(divide = "ignore", invalid = "ignore"):
+                stock_dt = np.where(rate < 0, levels/-rate, np.where(rate > 0, (size - levels)/rate, np.inf))
+            if len(stockpiles):
+                stockpile = stock_dt.argmin(axis = 1)
+                stock_dt = stock_dt[rows, stockpile]
+            else:
+                stockpile = np.zeros(replications, dtype = int)
+                stock_dt = np.full(replications, np.inf)
+            dt = np.minimum(np.minimum(machine_dt, stock_dt), horizon - t)
+            
+            production += output*dt
+            empty_time += (levels <= 0)*dt[:, None]
+            full_time += (levels >= size)*dt[:, None]
+            levels = np.clip(levels + rate*dt[:, None], 0, size)
+            
+            hit = np.flatnonzero(active & (stock_dt <= dt))
+            levels[hit, stockpile[hit]] = np.where(rate[hit, stockpile[hit]] < 0, 0, size[stockpile[hit]])
+            change = np.flatnonzero(active & (machine_dt <= dt))
+            up[change, machine[change]] = ~up[change, machine[change]]
+            mean = np.where(up[change, machine[change]], uptime[machine[change]], repair[machine[change]])
+            next_change[change, machine[change]] += rng.exponential(1, len(change))*mean
+            events += len(hit) + len(change)
+            t += dt
+        
+        return {"production" : production,
+                "mean_rate" : production.mean()/horizon,
+                "empty_fraction" : {name : empty_time[:, k]/horizon for k, name in enumerate(stockpile_names)},
+                "full_fraction" : {name : full_time[:, k]/horizon for k, name in enumerate(stockpile_names)},
+                "final_levels" : {name : levels[:, k] for k, name in enumerate(stockpile_names)},
+                "events" : events}
+        
+    def save(self, filename, key, extra = None):
+        """
+        Saves the compiled model to a binary file, so it can be memory mapped by System.load instead of being built again.
+        
+        The file is the 8 bytes "BRCACHE1", then the length of the header, and the offset of the arrays (uint64), then the header, 
+        which is json, and has the key, the block_list, extra, where each array is, and which block distributions are stored (by their class key, see BlockDistribution.class_key).
+        Then the arrays, machine_values, R1_sum_matrix, and the supports and probs of all the stored block distributions one after 
+        the other, each starting on a multiple of 64 bytes.
+        Every block distribution that is currently cached (or was loaded from a previous save) is stored.
+        The file is written to a temporary file first, then moved into place, so other processes never see half of one.
+
+        Parameters
+        ----------
+        filename : string
+            the path of the file to create
+        key : string
+            the key the file is saved under, System.load only loads the file if it is given the same key
+        extra : json compatible, optional
+            anything else to save with the model. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        align = lambda n: -(-n//64)*64
+        
+        tables = {}
+        support = []
+        probs = []
+        offset = 0
+        for block in self.block_list:
+            if block[0] == "Skip End":
+                continue
+            table = self.block_reliability_dist[block[1]]
+            stored = dict(table.stored)
+            for counts, dist in table.cache.items():
+                stored[counts] = (dist.support, dist.probs)
+            tables[block[1]] = []
+            for counts in stored:
+                tables[block[1]].append([[int(c) for c in counts], offset, len(stored[counts][0])])
+                support.append(np.asarray(stored[counts][0], dtype = "<f8"))
+                probs.append(np.asarray(stored[counts][1], dtype = "<f8"))
+                offset += len(stored[counts][0])
+        
+        arrays = {"machine_values" : np.asarray(self.machine_values, dtype = "<f8"),
+                  "R1_sum_matrix" : np.asarray(self.R1_sum_matrix, dtype = "<f8"),
+                  "support" : np.concatenate(support) if support else np.zeros(0),
+                  "probs" : np.concatenate(probs) if probs else np.zeros(0)}
         
+        header = {"version" : CACHE_VERSION,
+                  "key" : key,
+                  "block_list" : [[block[0], block[1], [list(machine) for machine in self.block_list[block]]] for block in self.block_list],
+                  "extra" : extra,
+                  "resolution" : self.resolution,
+                  "threshold" : self.threshold,
+                  "tables" : tables,
+                  "arrays" : {}}
+        position = 0
+        for name in arrays:
+            header["arrays"][name] = [position, arrays[name].dtype.str, list(arrays[name].shape)]
+            position += align(arrays[name].nbytes)
+        header = json.dumps(header).encode()
+        data_start = align(len(CACHE_MAGIC) + 16 + len(header))
+        
+        temporary = filename + "." + str(os.getpid()) + ".tmp"
+        with open(temporary, mode = 'wb') as file:
+            file.write(CACHE_MAGIC)
+            file.write(np.array([len(header), data_start], dtype = "<u8").tobytes())
+            file.write(header)
+            file.write(bytes(data_start - file.tell()))
+            for name in arrays:
+                file.write(arrays[name].tobytes())
+                file.write(bytes(align(arrays[name].nbytes) - arrays[name].nbytes))
+        os.replace(temporary, filename)
+        
+    def load(filename, key, cache_size = 1024):
+        """
+        Loads a model saved by System.save, the arrays and stored block distributions are memory mapped, so they are only read from
+        the file as they are used.
+
+        Parameters
+        ----------
+        filename : string
+            the path of the saved model
+        key : string
+            the key the model has to have been saved under
+        cache_size : int, optional
+            see System. The default is 1024.
+
+        Returns
+        -------
+        (System, extra) or None
+            the model and the extra information saved with it, or None if the file does not exist, is not a saved model, 
+            or was saved with a different key or version.
+
+        """
+        try:
+            with open(filename, mode = 'rb') as file:
+                if file.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                    return None
+                header_length, data_start = np.frombuffer(file.read(16), dtype = "<u8")
+                header = json.loads(file.read(int(header_length)).decode())
+        except (OSError, ValueError):
+            return None
+        if header.get("version") != CACHE_VERSION or header.get("key") != key:
+            return None
+        
+        arrays = {}
+        for name, (offset, dtype, shape) in header["arrays"].items():
+            if math.prod(shape) == 0:
+                arrays[name] = np.zeros(shape, dtype = dtype)
+            else:
+                arrays[name] = np.memmap(filename, dtype = dtype, mode = 'r', offset = int(data_start) + offset, shape = tuple(shape))
+        
+        system = System({(block[0], block[1]): [tuple(machine) for machine in block[2]] for block in header["block_list"]}, cache_size, header["resolution"], header["threshold"])
+        system.machine_values = arrays["machine_values"]
+        system.R1_sum_matrix = arrays["R1_sum_matrix"]
+        for name, entries in header["tables"].items():
+            table = system.block_reliability_dist[name]
+            for counts, offset, length in entries:
+                table.stored[tuple(counts)] = (arrays["support"][offset:offset+length], arrays["probs"][offset:offset+length])
+        
+        return system, header["extra"]
     
+
+class IncrementalEvaluator:
+    def __init__(self, system):
+        """
+        This class does the same thing as System.sample_reliability, but it keeps the state (see System.next_state) after each step 
+        from the last failures list it was given, so for the next failures list it only has to start again from the first block 
+        whose slice of the failures list has changed.
+        This is useful when going through a lot of failures lists that only differ in the later blocks, such as a sweep over the 
+        maintenance configurations.
+
+        Parameters
+        ----------
+        system : System
+            the system to evaluate
+
+        Returns
+        -------
+        None.
+
+        """
+        self.system = system
+        self.options = None
+        self.states = [EMPTY_STATE]
+        
+    def sample_reliability(self, failures):
+        """
+        Returns the throughput distribution, given a failures list, see System.sample_reliability
+        """
+        options = self.system.split_failures(failures)
+        
+        #states[i] is the state before step i of the plan
+        start = 0
+        if self.options is not None:
+            while start < len(options) and options[start] == self.options[start]:
+                start += 1
+        del self.states[start+1:]
+        
+        for step, option in zip(self.system.plan[start:], options[start:]):
+            self.states.append(self.system.next_state(self.states[-1], step, option))
+        
+        self.options = options
+        return self.states[-1][0]
         
         
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+import csv
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from Benchmark import generate_model
+from Block_Reliability import handle_csv
+
+EXAMPLE_MODELS = ["example_model.csv", "example_model2.csv", "example_model3.csv"]
+
+
+def load(filename):
+    return handle_csv(os.path.join(HERE, filename), cache = False).system
+
+
+def write_model(filename, blocks):
+    """
+    Writes a model csv file from a list of (block id, number of machines, block it skips to or "")
+    """
+    with open(filename, mode = 'w', newline = '') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Component", "Runtime", "Planned", "Availability", "Uterlisation ", "Loading ", "Capacity", "BlockID", "Skips_To"])
+        for block, machines, skips_to in blocks:
+            for machine in range(machines):
+                writer.writerow([block + "_" + str(machine), "", 0.05, 0.9, 0.75, 0.85, 100, block, skips_to if machine == 0 else ""])
+
+
+@pytest.mark.parametrize("filename", EXAMPLE_MODELS)
+def test_monte_carlo_mean_matches_sample_reliability(filename):
+    system = load(filename)
+    exact = system.sample_reliability(tuple([1]*len(system.machine_names))).expected()
+    low, high = system.monte_carlo(200000, seed = 0)["mean_ci"]
+    assert low <= exact <= high
+
+
+def test_monte_carlo_chain_without_skips(tmp_path):
+    filename = str(tmp_path/"chain.csv")
+    generate_model(filename, 30, skip_every = 0, stockpile_every = 0)
+    system = handle_csv(filename, cache = False).system
+    exact = system.sample_reliability(tuple([1]*len(system.machine_names))).expected()
+    low, high = system.monte_carlo(100000, seed = 0)["mean_ci"]
+    assert low <= exact <= high
+
+
+def test_stockpile_size_changes_simulation():
+    system = load("example_model2.csv")
+    small = system.simulate_stockpiles(2000, 1e-9, replications = 100, seed = 0)
+    large = system.simulate_stockpiles(2000, 1e12, replications = 100, seed = 0)
+    assert small["mean_rate"] < 0.9*large["mean_rate"]
+    assert small["empty_fraction"]["Stockpile_1"].mean() > large["empty_fraction"]["Stockpile_1"].mean()
+
+
+def test_nested_skips_are_not_evaluated_with_windows(tmp_path):
+    filename = str(tmp_path/"nested.csv")
+    write_model(filename, [("A", 1, ""), ("Skip_Outer", 1, "E"), ("B", 1, ""), ("Skip_Inner", 1, "D"), ("C", 2, ""), ("D", 1, ""), ("E", 2, "")])
+    system = handle_csv(filename, cache = False).system
+    failures = tuple([1]*len(system.machine_names))
+    assert system.sample_capacity(failures) == 100
+    with pytest.raises(ValueError):
+        system.sample_total_throughput(failures)
+    with pytest.raises(ValueError):
+        system.sample_total_throughput_batch([failures])
+
+
+def test_crossing_skips_raise(tmp_path):
+    filename = str(tmp_path/"crossing.csv")
+    write_model(filename, [("A", 1, ""), ("Skip_Outer", 1, "D"), ("B", 1, ""), ("Skip_Inner", 1, "E"), ("C", 2, ""), ("D", 1, ""), ("E", 2, "")])
+    with pytest.raises(ValueError):
+        handle_csv(filename, cache = False)
+
+
+def test_skip_straight_after_another_skip_is_nested(tmp_path):
+    filename = str(tmp_path/"adjacent.csv")
+    write_model(filename, [("A", 1, "E"), ("B", 1, "D"), ("C", 1, ""), ("D", 1, ""), ("E", 1, "")])
+    with open(filename, newline = '') as file:
+        rows = list(csv.reader(file))
+    for row, capacity in zip(rows[1:], [100, 10, 20, 1000, 10000]):
+        row[6] = capacity
+    with open(filename, mode = 'w', newline = '') as file:
+        csv.writer(file).writerows(rows)
+    system = handle_csv(filename, cache = False).system
+    assert system.sample_capacity((1, 1, 1, 1, 1)) == 130
+    dist = system.sample_reliability((1, 1, 1, 0, 1))
+    assert dist.cdf(0) == pytest.approx(0.19)
+    assert dist.expected() == pytest.approx(81)
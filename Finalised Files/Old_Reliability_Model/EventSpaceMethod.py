@@ -1,6 +1,7 @@
 from ReliabilityFunctions import FailureFunction
+from NodeGraph import CompiledGraph, rank_nodes
 import matplotlib.pyplot as plt
-from functools import lru_cache
+import numpy as np
 
 
 def DFSPaths(D, u, v):
@@ -35,11 +36,6 @@ def fill(character, length, current):
         return current
     return character*(length-len(current)) + current
 
-def most(x):
-    if x > 1:
-        return 1
-    return x
-
 class System:
     def __init__(self, node_info):
         """
@@ -58,48 +54,14 @@ class System:
 
         """
         
-        #Determine the order, and count of each node for displaying
-        #The algorithm works by assigning each node 3 values, its rank, its order, and the count
-        #a nodes rank is the distance the node is from IN
-        #the nodes order is used to distinguish between nodes of the same rank, ranging from 0 - number of node
-        #of that order
-        #the nodes count is the number of nodes with the same rank.
-        
-        #add the three values to the list of parameters for each node
-        for node in node_info:
-            node_info[node] = list(node_info[node]) + [[0,1,1],]
-        
-        Queue = ["IN",] #create a FIFO queue
-        while Queue:
-            nxt = Queue.pop(0) #take the first node from the queue
-            for check in node_info[nxt][2]: #assign the rank of current rank + 1 to all nodes connected
-                Queue.append(check)
-                node_info[check][4][0] = node_info[nxt][4][0] + 1
-            
-        node_count = {} #set up the mapping from node rank, a counter
-        for x in range(1+max([node_info[n][4][0] for n in node_info])):
-            node_count[x] = 0   
-            
-        for n in node_info: # iterate through the nodes, update the specific count for the nodes rank, and 
-                            # set the order of that node to the current count
-            node = node_info[n]
-            node[4][1] = node_count[node[4][0]]
-            node_count[node[4][0]] += 1
-            
-        for n in node_info: #set the count in each node to the count of its rank.
-            node = node_info[n]
-            node[4][2] = node_count[node[4][0]]
-    
-    
-        #Reorder the keys based on the nodes ranks.
-        node = [(x, node_info[x]) for x in node_info]
-        node = sorted(node, key = lambda x: x[1][4][0])
-
-        node_info = {x[0]: x[1] for x in node}
+        #Determine the rank, order, and count of each node for displaying, and reorder the keys based on the
+        #nodes ranks (see rank_nodes)
+        node_info = rank_nodes(node_info)
     
         self.node_info = node_info
         
-        
+        #the node graph compiled into arrays, for path_output
+        self.graph = CompiledGraph(node_info)
         
         self.all_paths = []
         
@@ -121,6 +83,9 @@ class System:
                     continue
                 Queue.append(test)
                 self.all_paths.append(test)
+        
+        #the system output of each of the paths, all found at once
+        self.path_outputs = self.path_output(np.array(self.all_paths)).tolist()
                 
         
                     
@@ -154,7 +119,6 @@ class System:
         
         plt.figure()
     
-    @lru_cache(maxsize=None)
     def path_output(self, failures):
         """
         This function tells you the output of the system, given certain nodes failing.
@@ -166,34 +130,24 @@ class System:
         we can iterate by rank, because nodes of the same rank will never lead into each other, and
         node of a greater rank will always only have input nodes of smaller ranks.
         
+        The node graph is compiled once into integer indexed arrays (see CompiledGraph), so many failures lists
+        can be given at once as the rows of a 2d array, and the outputs already found are kept in a cache.
+        
         Note: this algorithm requires the keys of the node_info to be ordered by rank.
 
         Parameters
         ----------
-        failures : binary
+        failures : binary, or array(int)
             a zero at position n means that the node whos key has index n has failed.
-            a one means otherwise.
+            a one means otherwise. A 2d array is one failures list on each row.
 
         Returns
         -------
-        float
-            the output of the system.
+        float, or array(float)
+            the output of the system, for each row if failures is 2d.
 
         """
-        cumulation = {} #maps each node to a list, the first value is the current sum of all input nodes
-                        #the second value is whether or not the node has failed.
-                        #the output of a node is these two values multiplied by each other
-        for index, node in enumerate(self.node_info):
-            if index == 0 or index == len(self.node_info)-1:
-                continue
-            cumulation[node] = [0, failures[index-1]]
-        cumulation["IN"] = [1, 1]
-        cumulation["OUT"] = [0, 1]
-        
-        for node in self.node_info: #iterate through the nodes.
-            for nxt in self.node_info[node][2]:
-                cumulation[nxt][0] = most(cumulation[nxt][0]+self.node_info[node][1]*cumulation[node][0]*cumulation[node][1])
-        return cumulation["OUT"][0] * cumulation["OUT"][1]
+        return self.graph.output(failures)
             
     
     def sample_reliability(self, t):
@@ -219,8 +173,7 @@ class System:
         """
         total = 0
         
-        for x in self.all_paths: #iterates through all the paths
-            R = self.path_output(x) #calcualtes the system output of the path
+        for x, R in zip(self.all_paths, self.path_outputs): #iterates through all the paths, with the system output of each
             
             P = 1 #sets the probability of this path 
             
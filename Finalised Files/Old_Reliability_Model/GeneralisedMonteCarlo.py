@@ -1,5 +1,11 @@
 from ReliabilityFunctions import FailureFunction
-from functools import lru_cache
+from NodeGraph import CompiledGraph, rank_nodes
+
+import copy
+import multiprocessing
+import os
+
+import numpy as np
 
 import matplotlib.pyplot as plt  
 
@@ -37,10 +43,20 @@ COMPLEXISH_TEST = {"IN":(None, 1, ("A","C"), 0),
                 "O":(FailureFunction(params = (1.2, 13)),1,("N",), 4),
                 "OUT":(None, 1, (), 0)}
 
-def most(x):
-    if x > 1:
-        return 1
-    return x
+def _init_simulate_worker(gmc):
+    global _simulate_worker_gmc
+    _simulate_worker_gmc = gmc
+
+def _simulate_part(args):
+    """
+    Runs one workers part of GMC.simulate_parallel, and returns its data list.
+    """
+    mode, n, seed, chunk_size = args
+    gmc = _simulate_worker_gmc
+    gmc.data = [0 for x in range(gmc.arange[2])]
+    gmc.sim_count = 0
+    getattr(gmc, "simulate_" + mode)(n, chunk_size, seed)
+    return gmc.data
 
 class GMC:
     def __init__(self, node_info, arange):
@@ -63,47 +79,15 @@ class GMC:
             the arange of times you wish to be able to sample
             of the form (starting value, ending value, number of steps)
         """
-        #Determine the order, and count of each node for displaying
-        #The algorithm works by assigning each node 3 values, its rank, its order, and the count
-        #a nodes rank is the distance the node is from IN
-        #the nodes order is used to distinguish between nodes of the same rank, ranging from 0 - number of node
-        #of that order
-        #the nodes count is the number of nodes with the same rank.
-        
-        #add the three values to the list of parameters for each node
-        for node in node_info:
-            node_info[node] = list(node_info[node]) + [[0,1,1],]
-        
-        Queue = ["IN",] #create a FIFO queue
-        while Queue:
-            nxt = Queue.pop(0) #take the first node from the queue
-            for check in node_info[nxt][2]: #assign the rank of current rank + 1 to all nodes connected
-                Queue.append(check)
-                node_info[check][4][0] = node_info[nxt][4][0] + 1
-            
-        node_count = {} #set up the mapping from node rank, a counter
-        for x in range(1+max([node_info[n][4][0] for n in node_info])):
-            node_count[x] = 0   
-            
-        for n in node_info: # iterate through the nodes, update the specific count for the nodes rank, and 
-                            # set the order of that node to the current count
-            node = node_info[n]
-            node[4][1] = node_count[node[4][0]]
-            node_count[node[4][0]] += 1
-            
-        for n in node_info: #set the count in each node to the count of its rank.
-            node = node_info[n]
-            node[4][2] = node_count[node[4][0]]
-        
-        
-        #Reorder the keys based on the nodes ranks.
-        node = [(x, node_info[x]) for x in node_info]
-        node = sorted(node, key = lambda x: x[1][4][0])
-        
-        node_info = {x[0]: x[1] for x in node}
+        #Determine the rank, order, and count of each node for displaying, and reorder the keys based on the
+        #nodes ranks (see rank_nodes)
+        node_info = rank_nodes(node_info)
         
         self.node_info = node_info
         
+        #the node graph compiled into arrays, for path_output
+        self.graph = CompiledGraph(node_info)
+        
         self.arange = arange
         
         #this array stores the reliability values calcualted in the simulation
@@ -141,7 +125,6 @@ class GMC:
         
         plt.figure()
            
-    @lru_cache(maxsize=None)
     def path_output(self, failures):
         """
         This function tells you the output of the system, given certain nodes failing.
@@ -153,34 +136,24 @@ class GMC:
         we can iterate by rank, because nodes of the same rank will never lead into each other, and
         node of a greater rank will always only have input nodes of smaller ranks.
         
+        The node graph is compiled once into integer indexed arrays (see CompiledGraph), so many failures lists
+        can be given at once as the rows of a 2d array, and the outputs already found are kept in a cache.
+        
         Note: this algorithm requires the keys of the node_info to be ordered by rank.
 
         Parameters
         ----------
-        failures : binary
+        failures : binary, or array(int)
             a zero at position n means that the node whos key has index n has failed.
-            a one means otherwise.
+            a one means otherwise. A 2d array is one failures list on each row.
 
         Returns
         -------
-        float
-            the output of the system.
+        float, or array(float)
+            the output of the system, for each row if failures is 2d.
 
         """
-        cumulation = {} #maps each node to a list, the first value is the current sum of all input nodes
-                        #the second value is whether or not the node has failed.
-                        #the output of a node is these two values multiplied by each other
-        for index, node in enumerate(self.node_info):
-            if index == 0 or index == len(self.node_info)-1:
-                continue
-            cumulation[node] = [0, failures[index-1]]
-        cumulation["IN"] = [1, 1]
-        cumulation["OUT"] = [0, 1]
-        
-        for node in self.node_info: #iterate through the nodes.
-            for nxt in self.node_info[node][2]:
-                cumulation[nxt][0] = most(cumulation[nxt][0]+self.node_info[node][1]*cumulation[node][0]*cumulation[node][1])
-        return cumulation["OUT"][0] * cumulation["OUT"][1]
+        return self.graph.output(failures)
     
     def simulate(self, n = 10000): 
         """
@@ -245,6 +218,222 @@ class GMC:
                 #print(failures, self.path_output(tuple(failures)))
                 self.data[step] += self.path_output(tuple(failures)) 
      
+    def repair_steps(self):
+        """
+        Returns the number of steps of the arange each node stays failed for, counted the way simulate counts them down,
+        for every node but IN and OUT.
+        """
+        step_size = (self.arange[1]-self.arange[0])/self.arange[2]
+        steps = []
+        for node in list(self.node_info)[1:-1]:
+            left = self.node_info[node][3]
+            count = 0
+            while True:
+                count += 1
+                left -= step_size
+                if left <= 0:
+                    break
+            steps.append(count)
+        return np.array(steps)
+    
+    def simulate_batch(self, n = 10000, chunk_size = None, seed = None):
+        """
+        This function does the same simulation as simulate, but for a chunk of iterations at a time with numpy arrays,
+        rather than one iteration, time step and node at a time.
+        
+        The algorithm works as follows:
+        
+        For each chunk of iterations:
+            sample the failure times of every component in every iteration at once
+            find the step of the arange each component fails at, and the step it is repaired at, from the number of 
+            steps it takes to be repaired
+            build the (iterations x steps) array of which nodes are failed at each step, with the failures of each step
+            packed into the bits of an integer, node n adding 2^n from the step it fails to the step it is repaired
+            find the different failures lists in it, and the output of the system for each of them with path_output
+            add the outputs at each step to the data list
+        
+        As in simulate, each component fails at most once, at the first of its failure times.
+
+        Parameters
+        ----------
+        n : int, optional
+            the number of iterations. The default is 10000.
+        chunk_size : int, optional
+            the number of iterations done at once. The default is None, for as many as keep the array of states to 2^23 entries.
+        seed : int, optional
+            the seed of the random number generator. The default is None.
+
+        """
+        rng = np.random.default_rng(seed)
+        nodes = list(self.node_info)[1:-1]
+        steps = self.arange[2]
+        if chunk_size is None:
+            chunk_size = max(1, 2**23//steps)
+        
+        times = self.arange[0] + (self.arange[1]-self.arange[0])*(np.arange(steps)/steps)
+        repair = self.repair_steps()
+        
+        self.sim_count += n
+        totals = np.zeros(steps)
+        for start in range(0, n, chunk_size):
+            count = min(chunk_size, n - start)
+            fail_times = np.stack([self.node_info[node][0].sample_array(count, rng)[:, 0] for node in nodes], axis = 1)
+            
+            fail_step = np.searchsorted(times, fail_times, "left") #the first step at or after the failure
+            repair_step = np.minimum(fail_step + repair, steps)
+            
+            if len(nodes) <= 62:
+                rows = np.arange(count)
+                changes = np.zeros((count, steps+1), dtype = np.int64)
+                for index in range(len(nodes)):
+                    changes[rows, fail_step[:, index]] += 1 << index
+                    changes[rows, repair_step[:, index]] -= 1 << index
+                outputs = self.graph.packed_output(changes[:, :-1].cumsum(axis = 1))
+            else: #too many nodes to pack into an integer, so whether each is working is kept in a boolean array
+                step = np.arange(steps)[None, :, None]
+                working = ~((step >= fail_step[:, None, :]) & (step < repair_step[:, None, :]))
+                outputs = self.path_output(working.reshape(-1, len(nodes))).reshape(count, steps)
+            totals += outputs.sum(axis = 0)
+        
+        for step, total in enumerate(totals.tolist()):
+            self.data[step] += total
+     
+    def simulate_events(self, n = 10000, chunk_size = None, seed = None):
+        """
+        This function does the simulation event by event, rather than stepping through the arange, so the output of the
+        system is only found when a component fails or is repaired, and how long each output lasted is added to the data
+        list exactly. So a finer arange costs nothing extra, and the error from counting down the repair time a step 
+        at a time in simulate goes away.
+        
+        The algorithm works as follows:
+        
+        For each chunk of iterations:
+            sample the failure times of every component in every iteration at once
+            a component is failed from each failure time until TTR after it (joining up the times it fails again while
+            it is still failed), so it has a list of times it fails and is repaired at
+            sort the failures and repairs of all the components of each iteration, and find which components are failed 
+            after each of them (packed into the bits of an integer, see CompiledGraph.packed_output), and the output of the system
+            each output is constant until the next event, so the integral of the output from the start of the arange to
+            each step is the sum over the events before it of (the change in the output) x (the time since the event)
+            the data of each step gets the mean output over the time from it to the next step
+        
+        Unlike simulate, a component that has more than one failure time (NDWeibull) fails at each of them.
+
+        Parameters
+        ----------
+        n : int, optional
+            the number of iterations. The default is 10000.
+        chunk_size : int, optional
+            the number of iterations done at once. The default is None, for as many as keep the arrays of events to 2^23 entries.
+        seed : int, optional
+            the seed of the random number generator. The default is None.
+
+        """
+        rng = np.random.default_rng(seed)
+        nodes = list(self.node_info)[1:-1]
+        start, end, steps = self.arange
+        edges = start + (end-start)*(np.arange(steps+1)/steps)
+        working = self.path_output(np.ones((1, len(nodes))))[0] #the output with nothing failed
+        
+        packed = len(nodes) <= 62 #otherwise which nodes are failed is kept in a boolean array, rather than the bits of an integer
+        if chunk_size is None:
+            events = 2*sum(self.node_info[node][0].sample_array(1).shape[1] for node in nodes)
+            chunk_size = max(1, 2**23//(events*(1 if packed else len(nodes))))
+        
+        self.sim_count += n
+        integral = np.zeros(steps+1) #the integral of the output from start to each edge, summed over the iterations
+        for first in range(0, n, chunk_size):
+            count = min(chunk_size, n - first)
+            
+            times = []
+            changes = []
+            for index, node in enumerate(nodes):
+                fail_times = self.node_info[node][0].sample_array(count, rng)
+                repaired = np.maximum.accumulate(fail_times + self.node_info[node][3], axis = 1)
+                before = np.concatenate((np.full((count, 1), -np.inf), repaired[:, :-1]), axis = 1)
+                fails = fail_times > before #it was working when it failed, rather than failing again while failed
+                times.append(np.concatenate((np.where(fails, fail_times, np.inf), np.where(fails[:, 1:], before[:, 1:], np.inf), repaired[:, -1:]), axis = 1))
+                change = np.concatenate((fails*1, -1*fails[:, 1:], -np.ones((count, 1), dtype = np.int64)), axis = 1)
+                if packed:
+                    changes.append(change << index)
+                else:
+                    changes.append(np.zeros(change.shape + (len(nodes),), dtype = np.int8))
+                    changes[-1][..., index] = change
+            times = np.concatenate(times, axis = 1)
+            changes = np.concatenate(changes, axis = 1)
+            
+            order = np.argsort(times, axis = 1, kind = "stable")
+            times = np.take_along_axis(times, order, axis = 1)
+            if packed:
+                outputs = self.graph.packed_output(np.take_along_axis(changes, order, axis = 1).cumsum(axis = 1))
+            else:
+                failed = np.take_along_axis(changes, order[..., None], axis = 1).cumsum(axis = 1)
+                outputs = self.path_output(1 - failed.reshape(-1, len(nodes))).reshape(count, -1)
+            
+            #the change in the output at each event, for the events before the end of the arange
+            jumps = np.diff(outputs, axis = 1, prepend = working)
+            keep = (times < end) & (jumps != 0)
+            event_times = np.maximum(times[keep], start)
+            jumps = jumps[keep]
+            
+            order = np.argsort(event_times)
+            event_times = event_times[order]
+            jumps = jumps[order]
+            before = np.searchsorted(event_times, edges, "left")
+            total_jump = np.concatenate(([0], jumps.cumsum()))[before]
+            total_moment = np.concatenate(([0], (jumps*event_times).cumsum()))[before]
+            integral += count*working*(edges - start) + edges*total_jump - total_moment
+        
+        step_size = (end-start)/steps
+        for step, total in enumerate(np.diff(integral).tolist()):
+            self.data[step] += total/step_size
+     
+    def simulate_parallel(self, n = 10000, processes = None, seed = None, mode = "batch", chunk_size = None):
+        """
+        This function splits the iterations of simulate_batch (or simulate_events) between processes, and adds up what
+        they get. Each process gets its own stream of random numbers, spawned from the one seed, so the same seed and number 
+        of processes always gives the same data, to the last bit.
+        
+        The node_info must be picklable (FailureFunction is). On platforms that start new processes rather than forking,
+        this must be run from under if __name__ == "__main__".
+
+        Parameters
+        ----------
+        n : int, optional
+            the number of iterations, over all the processes. The default is 10000.
+        processes : int, optional
+            the number of processes. The default is None, for the number of cores.
+        seed : int, optional
+            the seed the streams of every process are spawned from. The default is None, for a new one, which is kept in 
+            self.seed so the run can be repeated.
+        mode : string, optional
+            "batch" to use simulate_batch, or "events" to use simulate_events. The default is "batch".
+        chunk_size : int, optional
+            the chunk_size given to simulate_batch or simulate_events. The default is None.
+
+        """
+        if not mode in ("batch", "events"):
+            raise ValueError("mode must be batch or events, not " + str(mode))
+        if processes is None:
+            processes = os.cpu_count() or 1
+        
+        root = np.random.SeedSequence(seed)
+        self.seed = root.entropy
+        parts = [(mode, n//processes + (index < n % processes), child, chunk_size) for index, child in enumerate(root.spawn(processes))]
+        
+        if processes == 1:
+            _init_simulate_worker(copy.deepcopy(self))
+            results = [_simulate_part(parts[0])]
+        else:
+            with multiprocessing.Pool(processes, initializer = _init_simulate_worker, initargs = (self,)) as pool:
+                results = pool.map(_simulate_part, parts)
+        
+        #the parts are added up in order, so the sum is the same every time
+        self.sim_count += n
+        for result in results:
+            for step, total in enumerate(result):
+                self.data[step] += total
+    
     def summarise(self):
         
         plt.title("Expected Impact")
@@ -0,0 +1,241 @@
+from collections import deque
+
+import numpy as np
+
+
+def rank_nodes(node_info):
+    """
+    Returns a copy of node_info with 3 values added to the parameters of each node, its rank, its order, and the
+    count, with the keys ordered by rank. node_info itself is not changed.
+
+    a nodes rank is the length of the longest path to the node from IN (or from any other node nothing leads into)
+    the nodes order is used to distinguish between nodes of the same rank, ranging from 0 - number of nodes
+    of that rank
+    the nodes count is the number of nodes with the same rank.
+
+    The algorithm works as follows (a topological sort):
+
+    count the number of edges leading into each node
+    put the nodes with none in a FIFO queue, with a rank of 0
+    while the queue is not empty:
+        take the first node from the queue
+        for each node it leads to, set its rank to the most of its rank, and this nodes rank + 1, and remove the edge,
+        if that node has no edges left leading into it, all its input nodes have been done, so add it to the queue
+    if a node was never added to the queue, it is on a cycle, or after one
+
+    Each node and edge is gone through once, rather than once for every path to it from IN.
+
+    Parameters
+    ----------
+    node_info : dict
+        a mapping of each {node_name: (failfunc, contribution, node list, TTR)}
+
+    Raises
+    ------
+    ValueError
+        if the node graph has a cycle.
+
+    Returns
+    -------
+    dict
+        a mapping of each {node_name: [failfunc, contribution, node list, TTR, [rank, order, count]]}, ordered by rank, 
+        and in the order of node_info within each rank.
+
+    """
+    inputs = {node: 0 for node in node_info} #the number of edges leading into each node that are left
+    for node in node_info:
+        for nxt in node_info[node][2]:
+            inputs[nxt] += 1
+
+    rank = {node: 0 for node in node_info}
+    Queue = deque(node for node in node_info if inputs[node] == 0)
+    done = 0
+    while Queue:
+        nxt = Queue.popleft()
+        done += 1
+        for check in node_info[nxt][2]:
+            rank[check] = max(rank[check], rank[nxt] + 1)
+            inputs[check] -= 1
+            if inputs[check] == 0:
+                Queue.append(check)
+
+    if done < len(node_info):
+        raise ValueError("the node graph has a cycle, the nodes on or after it are " + ", ".join(str(node) for node in node_info if inputs[node] > 0))
+
+    node_count = {} #maps each rank to the number of nodes with that rank
+    ranked = {}
+    for node in node_info: #the order of each node is the number of nodes of the same rank before it
+        order = node_count.get(rank[node], 0)
+        node_count[rank[node]] = order + 1
+        ranked[node] = list(node_info[node]) + [[rank[node], order, 0],]
+
+    for node in ranked: #set the count in each node to the count of its rank.
+        ranked[node][4][2] = node_count[rank[node]]
+
+    #Reorder the keys based on the nodes ranks.
+    return {node: ranked[node] for node in sorted(ranked, key = lambda node: rank[node])}
+
+
+class CompiledGraph:
+    def __init__(self, node_info, cache_size = 65536):
+        """
+        This class is the node graph of a system compiled into integer indexed arrays, so the output of the system
+        (see GMC.path_output) can be found for many failures lists at once with numpy.
+
+        The nodes are numbered in the order of node_info, and the edges are kept as two arrays, the number of the node
+        each one starts at and ends at, in the order path_output goes through them, with the contribution of each node
+        in another array. The outputs found are kept in caches of at most cache_size failures lists (the oldest are dropped
+        first), one keyed by the failures list packed into the bits of an integer (bit n is set if node n, not counting IN,
+        has failed), used for arrays of them, and one keyed by the failures list itself, used for one at a time.
+
+        Parameters
+        ----------
+        node_info : dict
+            a mapping of each {node_name: (failfunc, contribution, node list, TTR, ...)}, ordered so that each node comes
+            after every node that leads into it, with "IN" first and "OUT" last.
+        cache_size : int, optional
+            the number of failures lists to keep the output of. The default is 65536.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.names = list(node_info)
+        index = {name: position for position, name in enumerate(self.names)}
+
+        self.contribution = np.array([node_info[name][1] for name in self.names], dtype = float)
+        edges = [(index[name], index[nxt]) for name in self.names for nxt in node_info[name][2]]
+        self.sources = np.array([edge[0] for edge in edges], dtype = int)
+        self.targets = np.array([edge[1] for edge in edges], dtype = int)
+        self.edges = edges
+        self.contributions = self.contribution.tolist()
+
+        self.cache_size = cache_size
+        self.cache = {}
+        self.single_cache = {}
+
+    def remember(self, cache, key, value):
+        """
+        Adds the output of a failures list to one of the caches, dropping the oldest one if it is full.
+        """
+        if len(cache) >= self.cache_size:
+            del cache[next(iter(cache))]
+        cache[key] = value
+
+    def evaluate(self, working):
+        """
+        Returns the output of the system for each row of working, without the cache.
+
+        Each nodes output is the sum of the nodes leading into it (at most 1), multiplied by the nodes contribution,
+        multiplied by if the node is working, and the edges are gone through in order, each one for every row at once.
+
+        Parameters
+        ----------
+        working : array(int)
+            a 2d array, each row has a 1 for each node (not counting IN and OUT) that is working, and a 0 if it has failed.
+
+        Returns
+        -------
+        array(float)
+            the output of the system for each row.
+
+        """
+        working = np.asarray(working, dtype = float)
+        cumulation = np.zeros((len(self.names), len(working))) #the sum of all the input nodes of each node, for each row
+        cumulation[0] = 1
+        up = np.ones((len(self.names), len(working)))
+        up[1:-1] = working.T
+
+        flow = self.contribution[:, None]*up
+        for source, target in zip(self.sources.tolist(), self.targets.tolist()):
+            cumulation[target] = np.minimum(cumulation[target] + flow[source]*cumulation[source], 1)
+        return cumulation[-1]*up[-1]
+
+    def evaluate_one(self, failures):
+        """
+        Returns the output of the system for one failures list, without the cache. This is evaluate for a single row, done
+        with python lists, which is faster than numpy for one row.
+        """
+        cumulation = [0,]*len(self.names)
+        cumulation[0] = 1
+        up = (1,) + tuple(failures) + (1,)
+        for source, target in self.edges:
+            cumulation[target] = min(cumulation[target] + self.contributions[source]*cumulation[source]*up[source], 1)
+        return cumulation[-1]*up[-1]
+
+    def packed_output(self, failed):
+        """
+        Returns the output of the system for an array (of any shape) of failures lists packed into integers, where bit n
+        is set if node n (not counting IN) has failed. The output is only found once for each different failures list,
+        from the cache if it is there, and the ones that are not are found together with evaluate.
+        """
+        failed = np.asarray(failed)
+        nodes = len(self.names)-2
+        #for a large array, the different failures lists are found with an array over every one there could be, rather than 
+        #by sorting
+        dense = nodes <= 22 and failed.dtype.kind in "iu" and failed.size >= (1 << nodes) >> 4
+        if dense:
+            seen = np.zeros(1 << nodes, dtype = bool)
+            seen[failed] = True
+            keys = np.flatnonzero(seen)
+            inverse = None
+        else:
+            keys, inverse = np.unique(failed, return_inverse = True)
+
+        outputs = np.empty(len(keys))
+        missing = []
+        for position, key in enumerate(keys.tolist()):
+            value = self.cache.get(key)
+            if value is None:
+                missing.append(position)
+            else:
+                outputs[position] = value
+        if missing:
+            if keys.dtype == object:
+                bits = np.array([[(key >> n) & 1 for n in range(nodes)] for key in keys[missing].tolist()]).reshape(len(missing), nodes)
+            else:
+                bits = (keys[missing, None] >> np.arange(nodes)) & 1
+            outputs[missing] = self.evaluate(1 - bits)
+            for position in missing:
+                self.remember(self.cache, int(keys[position]), float(outputs[position]))
+
+        if dense:
+            lookup = np.zeros(1 << nodes)
+            lookup[keys] = outputs
+            return lookup[failed]
+        return outputs[inverse.reshape(failed.shape)]
+
+    def output(self, failures):
+        """
+        Returns the output of the system for a failures list, or a 2d array of them (one on each row).
+
+        Parameters
+        ----------
+        failures : tuple(int) or array(int)
+            a zero at position n means that the node whos key has index n (not counting IN) has failed, a one means otherwise.
+
+        Returns
+        -------
+        float or array(float)
+            the output of the system, for each row if failures is 2d.
+
+        """
+        if isinstance(failures, tuple):
+            value = self.single_cache.get(failures)
+            if value is not None:
+                return value
+        if np.ndim(failures) == 1:
+            failures = tuple(failures.tolist()) if isinstance(failures, np.ndarray) else tuple(failures)
+            value = self.single_cache.get(failures)
+            if value is None:
+                value = self.evaluate_one(failures)
+                self.remember(self.single_cache, failures, value)
+            return value
+
+        failures = np.asarray(failures)
+        nodes = len(self.names)-2
+        if nodes <= 62:
+            return self.packed_output((failures == 0).astype(np.int64) @ (1 << np.arange(nodes, dtype = np.int64)))
+        packed = np.packbits(failures == 0, axis = 1, bitorder = "little")
+        return self.packed_output(np.array([int.from_bytes(row.tobytes(), "little") for row in packed], dtype = object))
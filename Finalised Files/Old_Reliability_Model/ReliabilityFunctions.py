@@ -32,6 +32,9 @@ class FailureFunction:
             
         """
         
+        self.choose = choose
+        self.params = params
+        
         if params is None:
             if choose == "Weibull":
                 params = (2,10)
@@ -45,16 +48,22 @@ class FailureFunction:
         if choose == "Weibull":
             self.sample_func = lambda : (((-1*math.log(1-random.random()))**(1/params[0]))*params[1],) 
             self.intg_func = lambda t : 0 if t <= 0 else 1 - math.exp(-1*(t/params[1])**params[0])
+            self.intg_array_func = lambda t : 1 - np.exp(-1*(np.maximum(t, 0)/params[1])**params[0])
+            self.sample_array_func = lambda count, rng : (rng.weibull(params[0], count)*params[1])[:, None]
 
         if choose == "Constant":
             self.sample_func = lambda : (params[0] < random.random(),)
             self.intg_func = lambda t : t * (params[0]/params[1]) #kinda jank, but if you "integrate" between 
                                                                 #t and t-ttr it will always return params[0]
+            self.intg_array_func = self.intg_func
+            self.sample_array_func = lambda count, rng : (params[0] < rng.random(count)).astype(float)[:, None]
                                                                 
         if choose == "Normal":
             adjusted_cdf = lambda x : norm.cdf((x-params[0])/params[1])
             self.sample_func = lambda : ((norm.ppf(random.random()*(1-adjusted_cdf(0)) + (adjusted_cdf(0)))+(params[0]/params[1])),)
             self.intg_func = lambda t : 0 if t <= 0 else adjusted_cdf(t) - adjusted_cdf(0)
+            self.intg_array_func = lambda t : np.where(t <= 0, 0, adjusted_cdf(t) - adjusted_cdf(0))
+            self.sample_array_func = lambda count, rng : ((norm.ppf(rng.random(count)*(1-adjusted_cdf(0)) + (adjusted_cdf(0)))+(params[0]/params[1])))[:, None]
 
         if choose == "NDWeibull":
             """
@@ -62,6 +71,19 @@ class FailureFunction:
             """
             weibull = lambda beta, eta: ((-1*math.log(1-random.random()))**(1/beta))*eta
             self.sample_func = lambda : (lambda count: (lambda inp: tuple([sum(inp[:n+1]) for n in range(len(inp))]))([weibull(params[1+x][0],params[1+x][1]) for x in range(int(count))]))(np.random.choice(range(1,len(params[0])+1), p = params[0])) 
+            def sample_array_func(count, rng):
+                failures = rng.choice(range(1,len(params[0])+1), p = params[0], size = count)
+                times = np.cumsum([rng.weibull(params[1+x][0], count)*params[1+x][1] for x in range(len(params[0]))], axis = 0).T
+                return np.where(np.arange(len(params[0])) < failures[:, None], times, np.inf)
+            self.sample_array_func = sample_array_func
+            
+    def __getstate__(self):
+        #the sample and intg functions are lambdas, which can not be pickled, so they are made again from the choice and params
+        return {"choose" : self.choose, "params" : self.params}
+    
+    def __setstate__(self, state):
+        FailureFunction.__init__(self, state["choose"], state["params"])
+        
     def sample(self):
         """
         This function samples the distribution.
@@ -73,21 +95,43 @@ class FailureFunction:
         """
         return self.sample_func()
     
+    def sample_array(self, count, rng = None):
+        """
+        This function samples the distribution count times at once.
+
+        Parameters
+        ----------
+        count : int
+            the number of samples.
+        rng : numpy.random.Generator, optional
+            the random number generator to sample with. The default is None, for a new unseeded one.
+
+        Returns
+        -------
+        array(float)
+            count x (the most failures a sample can have), the times each sample failed, in order, with inf after its last failure.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        return self.sample_array_func(count, rng)
+    
     def intg(self, t):
         """
         This function integrates the function between 0-t
 
         Parameters
         ----------
-        t : float
-            the time you wish to integrate to.
+        t : float or array(float)
+            the time you wish to integrate to, or an array of times, to integrate to each of them at once.
 
         Returns
         -------
-        float
-            the integral of the distribution.
+        float or array(float)
+            the integral of the distribution, an array the same shape as t if t is an array.
 
         """
+        if isinstance(t, np.ndarray):
+            return self.intg_array_func(t.astype(float))
         return self.intg_func(t)
         
 if __name__ == "__main__":